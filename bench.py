@@ -0,0 +1,371 @@
+"""bench.py: synthetic ICS generator and import benchmark.
+
+Generates Google Calendar style exports with `Area:/Type:/Project:`
+descriptions and imports them with converter.py, reporting events/sec,
+peak RSS and time per import stage (parse, normalize, lookup, insert).
+The dashboard queries of CalendarModel are then timed against the imported
+database, with their EXPLAIN QUERY PLAN.
+
+    python bench.py                          # 10k, 100k and 1M events
+    python bench.py --sizes 10000 50000      # custom sizes
+
+Results are written to bench_results.json; the previous results in that
+file are compared against so regressions show up from one run to the next.
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import converter
+import models
+
+BASE_DIR = Path(__file__).resolve().parent
+BENCH_DIR = Path(tempfile.gettempdir()) / "gcal-bench"
+RESULTS_FILE = BASE_DIR / "bench_results.json"
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# Share of events per calendar, roughly the split of the bundled calendars
+CALENDARS = {"saeed": 0.6, "work": 0.2, "growth": 0.15, "study": 0.05}
+
+# area -> (types, projects)
+AREAS = {
+    "Health": (["Sleep", "Medical", "Workout", "Walk"], []),
+    "Leisure": (["Movie", "Social Media", "Game", "Reading"], []),
+    "Dev": (["Tool Config", "Coding", "Code Review", "Debug"], ["Gcal", "Dotfiles"]),
+    "Teaching": (["Class", "Prepare"], ["Arad", "Python Course"]),
+    "Content": (["Instagram", "Youtube", "Blog"], ["Channel"]),
+    "Study": (["Course", "Book", "Paper"], ["Algorithms", "Databases"]),
+}
+DIFFICULTIES = ["Very Easy", "Easy", "Medium", "Hard"]
+TAGS = ["linux", "tool", "python", "neovim", "sql", "tkinter", "git"]
+
+STAGES = (
+    "parse",
+    "normalize",
+    "lookup",
+    "insert",
+    "segments",
+    "facets",
+    "rollups",
+    "search",
+    "analyze",
+)
+# Random (calendar, date range) pairs each dashboard query is timed over
+QUERY_RANGES = 20
+
+
+def fold(line):
+    """Fold a content line at 75 octets as RFC 5545 requires"""
+    if len(line) <= 75:
+        return line + "\r\n"
+    chunks = [line[:75]]
+    chunks.extend(line[i : i + 74] for i in range(75, len(line), 74))
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def escape_text(text):
+    return text.replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;")
+
+
+def random_description(rng):
+    area = rng.choice(list(AREAS))
+    types, projects = AREAS[area]
+    lines = [f"Area: {area}"]
+    if types and rng.random() < 0.8:
+        lines.append(f"Type: {rng.choice(types)}")
+    if projects and rng.random() < 0.5:
+        lines.append(f"Project: {rng.choice(projects)}")
+    if rng.random() < 0.7:
+        lines.append(f"Difficulty: {rng.choice(DIFFICULTIES)}")
+    if rng.random() < 0.4:
+        lines.append(f"Tags: {', '.join(rng.sample(TAGS, rng.randint(1, 3)))}")
+
+    # Descriptions edited in the Google Calendar UI come back as HTML
+    if rng.random() < 0.05:
+        return escape_text("<br>".join(lines))
+    return "\\n".join(escape_text(line) for line in lines)
+
+
+def generate_ics(path, calendar_name, n_events, seed=0):
+    """Write a Google style ICS export with n_events random VEVENTs"""
+    rng = random.Random(f"{seed}-{calendar_name}")
+    first_day = datetime(2021, 1, 1)
+    days = (datetime(2025, 12, 31) - first_day).days
+    stamp = "20251130T174044Z"
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(
+            "BEGIN:VCALENDAR\r\n"
+            "PRODID:-//Google Inc//Google Calendar 70.9054//EN\r\n"
+            "VERSION:2.0\r\n"
+            "CALSCALE:GREGORIAN\r\n"
+            "METHOD:PUBLISH\r\n"
+            f"X-WR-CALNAME:{calendar_name.title()}\r\n"
+            "X-WR-TIMEZONE:Asia/Tehran\r\n"
+        )
+        for i in range(n_events):
+            start = first_day + timedelta(
+                days=rng.randrange(days), minutes=15 * rng.randrange(96)
+            )
+            lines = ["BEGIN:VEVENT"]
+            if rng.random() < 0.03:
+                lines.append(f"DTSTART;VALUE=DATE:{start:%Y%m%d}")
+                lines.append(f"DTEND;VALUE=DATE:{start + timedelta(days=1):%Y%m%d}")
+            else:
+                end = start + timedelta(minutes=15 * rng.randint(1, 16))
+                lines.append(f"DTSTART:{start:%Y%m%dT%H%M%S}Z")
+                lines.append(f"DTEND:{end:%Y%m%dT%H%M%S}Z")
+            lines.extend(
+                [
+                    f"DTSTAMP:{stamp}",
+                    f"UID:{calendar_name}-{i}@google.com",
+                    f"CREATED:{stamp}",
+                    f"DESCRIPTION:{random_description(rng)}",
+                    f"LAST-MODIFIED:{stamp}",
+                    "SEQUENCE:0",
+                    "STATUS:CONFIRMED",
+                    f"SUMMARY:{escape_text(rng.choice(TAGS).title())} session",
+                    "TRANSP:OPAQUE",
+                    "END:VEVENT",
+                ]
+            )
+            f.write("".join(fold(line) for line in lines))
+        f.write("END:VCALENDAR\r\n")
+
+
+def generate_calendars(n_events, seed=0):
+    """Generate (or reuse) n_events split over CALENDARS, return the paths"""
+    directory = BENCH_DIR / str(n_events)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for calendar_name, share in CALENDARS.items():
+        path = directory / f"{calendar_name}.ics"
+        if not path.exists():
+            generate_ics(path, calendar_name, int(n_events * share), seed)
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb(who):
+    """Peak resident set size of this process or its children in MB"""
+    peak = resource.getrusage(who).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_size(n_events):
+    """Import the n_events data set twice: staged (serial) and parallel"""
+    paths = generate_calendars(n_events)
+    directory = BENCH_DIR / str(n_events)
+    result = {"events": n_events, "file_mb": sum(p.stat().st_size for p in paths) / 2**20}
+
+    # Serial import, stage times all measured in this process
+    staged_db = directory / "staged.db"
+    staged_db.unlink(missing_ok=True)
+    importer = converter.IcsToDb(
+        staged_db, streaming=True, batch_size=converter.BATCH_SIZE
+    )
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        imported = importer.import_calendars(
+            paths, converter.CALENDAR_COLORS, workers=1
+        )
+    seconds = time.perf_counter() - start
+    result["imported"] = imported
+    result["serial"] = {
+        "seconds": seconds,
+        "events_per_sec": imported / seconds,
+        "stages": {stage: importer.stats.stage_times.get(stage, 0) for stage in STAGES},
+        "skipped": importer.stats.counts["skipped"],
+        "invalid": importer.stats.counts["invalid"],
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+    }
+
+    # Full pipeline: process pool, shadow db, validation and swap
+    parallel_db = directory / "parallel.db"
+    parallel_db.unlink(missing_ok=True)
+    stats = converter.PipelineStats()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        imported = converter.import_sources(paths, parallel_db, stats=stats)
+    seconds = time.perf_counter() - start
+    result["parallel"] = {
+        "seconds": seconds,
+        "events_per_sec": imported / seconds,
+        # Summed over worker processes
+        "stages": {stage: stats.stage_times.get(stage, 0) for stage in STAGES},
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    result["queries"] = run_queries(parallel_db)
+    return result
+
+
+def dashboard_queries(model, names):
+    """name -> function(calendar_id, start_date, end_date) of the timed queries"""
+    area, type_name, project = names
+    return {
+        "get_top_areas": model.get_top_areas,
+        "get_top_types": model.get_top_types,
+        "get_top_projects": model.get_top_projects,
+        "distinct_areas_by_date_range": model.distinct_areas_by_date_range,
+        "distinct_types_by_date_range": model.distinct_types_by_date_range,
+        "distinct_projects_by_date_range": model.distinct_projects_by_date_range,
+        "distinct_facets_by_date_range": lambda *range_: (
+            model.distinct_facets_by_date_range(*range_, "tags")
+        ),
+        "area_daily_duration": lambda *range_: model.area_daily_duration(*range_, area),
+        "type_daily_duration": lambda *range_: model.type_daily_duration(*range_, type_name),
+        "project_report": lambda *range_: model.project_report(*range_, project),
+    }
+
+
+def run_queries(db_path, seed=0):
+    """Mean milliseconds and query plan of each dashboard query, from SQLite"""
+    models.DB_FILE = db_path
+    db = models.DatabaseManager()
+    # Time SQLite, not the columnar snapshot or cached results
+    db.snapshot = None
+    db.cache = models.QueryCache(max_size=0)
+    statements = []
+    # One thread reuses the pool's last returned reader: this one
+    with db.pool.reader() as conn:
+        conn.set_trace_callback(statements.append)
+
+    rng = random.Random(seed)
+    calendar_ids = [row.id for row in db.fetch_all("SELECT id FROM calendars")]
+    ranges = []
+    for _ in range(QUERY_RANGES):
+        start = date(2021, 1, 1) + timedelta(days=rng.randrange(5 * 365))
+        end = start + timedelta(days=rng.choice((7, 30, 365, 5 * 365)))
+        ranges.append((rng.choice(calendar_ids), str(start), str(end)))
+    names = [
+        db.fetch_one(f"SELECT name FROM {table} ORDER BY id").name
+        for table in ("areas", "types", "projects")
+    ]
+
+    results = {}
+    for name, query in dashboard_queries(db.model, names).items():
+        statements.clear()
+        query(*ranges[0])
+        sql = statements[-1]
+        plan = db.fetch_all(f"EXPLAIN QUERY PLAN {sql}")
+
+        start = time.perf_counter()
+        for range_ in ranges:
+            query(*range_)
+        results[name] = {
+            "ms": (time.perf_counter() - start) * 1000 / len(ranges),
+            "plan": [row.detail for row in plan],
+        }
+    db.close()
+    return results
+
+
+def run_isolated(n_events):
+    """Run run_size in a fresh interpreter so peak RSS is per data set"""
+    completed = subprocess.run(
+        [sys.executable, __file__, "--run-size", str(n_events)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(previous, results):
+    """Print events/sec change against the previous run of the same size"""
+    before = {result["events"]: result for result in previous.get("results", [])}
+    for result in results:
+        old = before.get(result["events"])
+        if not old:
+            continue
+        for mode in ("serial", "parallel"):
+            old_rate = old[mode]["events_per_sec"]
+            new_rate = result[mode]["events_per_sec"]
+            change = (new_rate - old_rate) / old_rate * 100
+            print(
+                f"{result['events']:>9} {mode:<8} {old_rate:>10.0f} -> "
+                f"{new_rate:>10.0f} events/sec ({change:+.1f}%)"
+            )
+        for name, query in result.get("queries", {}).items():
+            old_query = old.get("queries", {}).get(name)
+            if not old_query:
+                continue
+            change = (query["ms"] - old_query["ms"]) / old_query["ms"] * 100
+            print(
+                f"{result['events']:>9} {name:<34} {old_query['ms']:>7.2f} -> "
+                f"{query['ms']:>7.2f} ms ({change:+.1f}%)"
+            )
+            if query["plan"] != old_query["plan"]:
+                print(f"{'':>10}plan was: {' | '.join(old_query['plan'])}")
+                print(f"{'':>10}plan now: {' | '.join(query['plan'])}")
+
+
+def print_result(result):
+    serial = result["serial"]
+    parallel = result["parallel"]
+    stages = ", ".join(f"{stage} {secs:.2f}s" for stage, secs in serial["stages"].items())
+    print(f"\n{result['events']} events ({result['file_mb']:.1f} MB of ICS)")
+    print(
+        f"  serial:   {serial['seconds']:.2f}s, {serial['events_per_sec']:.0f} events/sec, "
+        f"peak RSS {serial['peak_rss_mb']:.0f} MB"
+    )
+    print(f"            {stages}")
+    print(
+        f"  parallel: {parallel['seconds']:.2f}s, {parallel['events_per_sec']:.0f} events/sec, "
+        f"worker peak RSS {parallel['worker_peak_rss_mb']:.0f} MB"
+    )
+    print("  queries:")
+    for name, query in result["queries"].items():
+        print(f"    {name:<34} {query['ms']:>7.2f} ms  {' | '.join(query['plan'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ICS importer.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--output", type=Path, default=RESULTS_FILE)
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        print(json.dumps(run_size(args.run_size)))
+        return
+
+    results = []
+    for n_events in args.sizes:
+        print(f"Generating {n_events} events in {BENCH_DIR / str(n_events)}...")
+        generate_calendars(n_events)
+        result = run_isolated(n_events)
+        print_result(result)
+        results.append(result)
+
+    if args.output.exists():
+        print("\nCompared with the previous run:")
+        compare(json.loads(args.output.read_text()), results)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""connections.py: SQLite connections shared by the app, the importer and sync.py.
+
+The live database runs in WAL mode: readers see the last commit and never
+wait for a writer, and a writer never waits for readers. Writers wait for
+each other up to BUSY_TIMEOUT_MS instead of failing with "database is
+locked". ConnectionPool gives the app one writer and a pool of read-only
+connections, so queries can run on any thread while an import writes.
+write_lock keeps importers in different processes from writing at once.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# How long a writer waits for another one. Installing an import of 1M
+# events holds the write lock for about 4s.
+BUSY_TIMEOUT_MS = 10_000
+# Bytes of the database file read through a memory map instead of read()
+MMAP_SIZE = 256 * 1024 * 1024
+# Idle read-only connections a ConnectionPool keeps open
+READ_POOL_SIZE = 4
+# How often a waiting write_lock tries again on Windows, which has no
+# file lock call that waits for as long as it takes
+LOCK_RETRY_SECONDS = 0.1
+
+
+def connect(db_path, readonly=False):
+    """
+    Connection to db_path with the busy timeout and mmap size set. Any
+    thread may use it, one at a time: the caller (a ConnectionPool, or one
+    importer) makes sure of that, so check_same_thread is off.
+    """
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{db_path}?mode=ro",
+            uri=True,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+    else:
+        conn = sqlite3.connect(
+            db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False
+        )
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+def enable_wal(conn):
+    """Switch conn's database to WAL mode; it stays in WAL mode on disk"""
+    conn.execute("PRAGMA journal_mode = WAL")
+
+
+class ConnectionPool:
+    """
+    One writer connection and a pool of read-only connections to db_path.
+
+    reader() lends an idle read-only connection, or opens one when all are
+    in use, and keeps up to size of them open once returned. writer()
+    lends the writer to one thread at a time.
+    """
+
+    def __init__(self, db_path, size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        # Last returned first, so a single thread keeps reusing one
+        self.idle = queue.LifoQueue()
+        self.write_lock = threading.Lock()
+        # Opened first: creates the file, then readers find it in WAL mode
+        self.write_conn = connect(db_path)
+        enable_wal(self.write_conn)
+        self.write_conn.execute("PRAGMA foreign_keys = ON")
+
+    @contextmanager
+    def reader(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = connect(self.db_path, readonly=True)
+        try:
+            yield conn
+        finally:
+            if self.idle.qsize() < self.size:
+                self.idle.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        with self.write_lock:
+            yield self.write_conn
+
+    def close(self):
+        with self.write_lock:
+            self.write_conn.commit()
+            self.write_conn.close()
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def lock_file(f, blocking=True):
+    """
+    Lock open file f for this process. Waits while another process holds
+    it, or raises BlockingIOError if blocking is False.
+    """
+    if os.name != "nt":
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    while True:
+        # msvcrt locks bytes from the current position
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if not blocking:
+                raise BlockingIOError(f"{f.name} is locked")
+            time.sleep(LOCK_RETRY_SECONDS)
+
+
+def unlock_file(f):
+    if os.name != "nt":
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def write_lock(db_path, blocking=True):
+    """
+    Hold db_path's lock file (db/<name>.lock) while changing db_path, so
+    the app and sync.py never import or extend the window at once. Waits
+    for the process holding it, or raises BlockingIOError if blocking is
+    False. The OS releases it when its process exits, too.
+    """
+    db_path = Path(db_path)
+    lock_path = db_path.with_name(db_path.name + ".lock")
+    with open(lock_path, "a") as f:
+        lock_file(f, blocking)
+        try:
+            yield
+        finally:
+            unlock_file(f)
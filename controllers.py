@@ -1,10 +1,11 @@
 """contoller.py: core part. get data from model and listen to view."""
 
-import os
 import glob
-import zipfile
+import threading
 from pathlib import Path
 
+import numpy as np
+
 import converter
 from models import DatabaseManager
 
@@ -13,6 +14,15 @@ ICS_DIR = BASE_DIR / "ics"
 DB_DIR = BASE_DIR / "db"
 DB_FILE = DB_DIR / "data.db"
 SECONDS_PER_HOUR = 3600
+# How often to check for imports made by sync.py
+DB_POLL_MS = 5000
+# converter.DEDUPE_POLICIES entry for zip imports: "calendar" drops the
+# copies a re-export leaves in a calendar, which count its hours twice
+IMPORT_DEDUPE = "calendar"
+# How often to check on a recurrence window extension running in the
+# background, and to try again while an import holds the database
+WINDOW_POLL_MS = 100
+WINDOW_RETRY_MS = 1000
 
 class Controller:
     def __init__(self, context):
@@ -27,6 +37,11 @@ class Controller:
         self.bar_chart_view = context.get_view("bar_chart")
         self.hbar_chart_view = context.get_view("hbar_chart")
         self.pie_chart_view = context.get_view("pie_chart")
+        # Recurrence window extension running in the background, and its
+        # (start, end) dates and result
+        self.window_thread = None
+        self.window_request = None
+        self.window_extended = False
 
         # Register events
         self.action_view.register_event_handler("read_calendars", self.handle_read_calendars)
@@ -46,11 +61,13 @@ class Controller:
 
     def initialize(self):
         """First load +  methods must only run once."""
+        self.ensure_recurrence_window()
 
         # calendars
         self.create_calendars_card()
         self.update_calendars_card()
 
+        self.refresh_dashboard()
         # widgets
         self.update_item_widget()
 
@@ -64,20 +81,124 @@ class Controller:
         self.create_report_rows()
         self.update_filter_report()
 
-    def create_calendars_card(self):
+        self.calendar_view.after(DB_POLL_MS, self.watch_database)
+
+    def watch_database(self):
+        """Pick up imports made outside the app (sync.py)."""
+        if self.db.has_changed():
+            generation = self.db.generation
+            self.db.swap()
+            self.refresh_calendars(self.model.calendars_changed_since(generation))
+        self.calendar_view.after(DB_POLL_MS, self.watch_database)
+
+    def refresh_calendars(self, calendar_ids):
+        """Refresh the cards of calendar_ids, and the charts if one is selected.
+
+        Calendars an import added get a card, removed ones lose theirs.
+        """
+        selected_calendar_id = self.calendar_view.selected_calendar_id
         calendars = self.model.get_calendars_by_usage()
-        self.calendar_view.create_cards(calendars)
+        current_ids = {calendar.calendar_id for calendar in calendars}
+        removed_ids = [
+            calendar_id
+            for calendar_id in self.calendar_view.cards
+            if calendar_id not in current_ids
+        ]
+        if removed_ids:
+            self.calendar_view.remove_cards(removed_ids)
+
+        new_calendars = [
+            calendar
+            for calendar in calendars
+            if calendar.calendar_id not in self.calendar_view.cards
+        ]
+        if new_calendars:
+            self.calendar_view.create_cards(new_calendars)
 
-    def create_report_rows(self):
-        calendar_id = self.calendar_view.selected_calendar_id
+        for calendar in calendars:
+            if calendar.calendar_id in calendar_ids:
+                self.calendar_view.update_card(calendar)
+
+        if (
+            self.calendar_view.selected_calendar_id in calendar_ids
+            or self.calendar_view.selected_calendar_id != selected_calendar_id
+        ):
+            self.handle_calendar_select()
+
+    def ensure_recurrence_window(self):
+        """Materialize recurring events for the selected dates if needed.
+
+        The window is read through the read pool. Extending it writes to
+        the database and snapshot, so it runs on a worker thread (see
+        check_window_thread), one extension at a time.
+        """
+        if self.window_thread:
+            # check_window_thread looks at the dates again when it ends
+            return
         start_date = self.filter_view.start_date
         end_date = self.filter_view.end_date
-        filter_val = self.filter_view.filter_var.get()
-        item = self.filter_view.item_var.get()
-        report = self.model.report_by_filter(
-            calendar_id, start_date, end_date, filter_val, item
+        window = self.model.recurrence_window()
+        if window and window[0] <= start_date and end_date <= window[1]:
+            return
+
+        self.window_request = (start_date, end_date)
+        self.window_thread = threading.Thread(
+            target=self.extend_window, args=self.window_request, daemon=True
+        )
+        self.window_thread.start()
+        self.calendar_view.after(WINDOW_POLL_MS, self.check_window_thread)
+
+    def extend_window(self, start_date, end_date):
+        """Worker thread: materialize recurring events for start_date..end_date."""
+        self.window_extended = False
+        importer = converter.IcsToDb(DB_FILE, batch_size=converter.BATCH_SIZE)
+        try:
+            self.window_extended = importer.extend_recurrence_window(
+                start_date, end_date, blocking=False
+            )
+        except BlockingIOError:
+            # an import (sync.py) holds the database, try again later
+            self.window_extended = None
+
+    def check_window_thread(self):
+        """Refresh the UI once the window thread is done."""
+        if self.window_thread.is_alive():
+            self.calendar_view.after(WINDOW_POLL_MS, self.check_window_thread)
+            return
+        self.window_thread = None
+
+        if self.window_extended is None:
+            self.calendar_view.after(WINDOW_RETRY_MS, self.ensure_recurrence_window)
+            return
+        if self.window_extended:
+            # new events, new snapshot
+            self.db.load_snapshot()
+            self.update_calendars_card()
+            self.handle_calendar_select()
+        if (self.filter_view.start_date, self.filter_view.end_date) != self.window_request:
+            # dates picked while it ran
+            self.ensure_recurrence_window()
+
+    def refresh_dashboard(self, item=None):
+        """Query what the charts, item list and report show for the filters.
+
+        item None picks the filter's top value, as a new item list does.
+        The update_* methods render from self.dashboard.
+        """
+        self.dashboard = self.model.dashboard_snapshot(
+            self.calendar_view.selected_calendar_id,
+            self.filter_view.start_date,
+            self.filter_view.end_date,
+            self.filter_view.filter_var.get(),
+            item,
         )
-        self.report_view.create_report_rows(report)
+
+    def create_calendars_card(self):
+        calendars = self.model.get_calendars_by_usage()
+        self.calendar_view.create_cards(calendars)
+
+    def create_report_rows(self):
+        self.report_view.create_report_rows(self.dashboard.report)
 
     def update_calendars_card(self):
         calendars = self.model.get_calendars_by_usage()
@@ -85,75 +206,36 @@ class Controller:
             self.calendar_view.update_card(calendar)
 
     def update_item_widget(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = self.filter_view.start_date
-        end_date = self.filter_view.end_date
-        filter_val = self.filter_view.filter_var.get()
-        rows = self.model.distinct_values_by_filter(
-            calendar_id, start_date, end_date, filter_val
-        )
-        values = [row.name for row in rows]
-        self.filter_view.update_item_values(values)
+        self.filter_view.update_item_values(list(self.dashboard.items))
 
     def update_filter_report(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = self.filter_view.start_date
-        end_date = self.filter_view.end_date
-        filter_val = self.filter_view.filter_var.get()
-        item = self.filter_view.item_var.get()
-        report = self.model.report_by_filter(
-            calendar_id, start_date, end_date, filter_val, item
-        )
-        self.report_view.update_rows(report)
+        self.report_view.update_rows(self.dashboard.report)
 
     # -- update charts --
     def update_bar_chart(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = str(self.filter_view.start_date)
-        end_date = str(self.filter_view.end_date)
-        types = self.model.distinct_types_by_date_range(
-            calendar_id, start_date, end_date
-        )
-        self.bar_chart_view.update_bar_chart(types)
+        self.bar_chart_view.update_bar_chart(self.dashboard.types)
 
     def update_stack_chart(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = self.filter_view.start_date
-        end_date = self.filter_view.end_date
-        filter_val = self.filter_view.filter_var.get()
-        item = self.filter_view.item_var.get()
-        rows = self.model.daily_duration_by_filter(
-            calendar_id, start_date, end_date, filter_val, item
-        )
-        if item:
+        dashboard = self.dashboard
+        if dashboard.item:
             # chart
-            days = range(1, len(rows) + 1)
-            hrs = [row.total_duration for row in rows]
-            calendar = self.model.get_calendar_by_usage(calendar_id)
-            self.stack_chart_view.update_stack_chart(days, hrs, calendar.calendar_color)
+            hrs = dashboard.daily_columns["total_duration"]
+            days = np.arange(1, len(hrs) + 1)
+            self.stack_chart_view.update_stack_chart(
+                days, hrs, dashboard.calendar.calendar_color
+            )
 
     def update_hbar_chart(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = str(self.filter_view.start_date)
-        end_date = str(self.filter_view.end_date)
-        areas = self.model.distinct_areas_by_date_range(
-            calendar_id, start_date, end_date
-        )
-        self.hbar_chart_view.update_hbar_chart(areas)
+        self.hbar_chart_view.update_hbar_chart(self.dashboard.areas)
 
     def update_pie_chart(self):
-        calendar_id = self.calendar_view.selected_calendar_id
-        start_date = str(self.filter_view.start_date)
-        end_date = str(self.filter_view.end_date)
-        projects = self.model.distinct_projects_by_date_range(
-            calendar_id, start_date, end_date
-        )
-        self.pie_chart_view.update_pie_chart(projects)
+        self.pie_chart_view.update_pie_chart(self.dashboard.projects)
 
     # --------------
     # Handlers
     # ---------------
     def handle_calendar_select(self):
+        self.refresh_dashboard()
         self.update_item_widget()
         self.update_stack_chart()
         self.update_pie_chart()
@@ -162,11 +244,16 @@ class Controller:
         self.update_filter_report()
 
     def handle_filter_select(self):
+        self.refresh_dashboard()
         self.update_item_widget()
         self.update_stack_chart()
         self.update_filter_report()
 
     def handle_start_date_selected(self):
+        # recurring events outside the materialized window change the totals,
+        # the charts are refreshed again once they are added
+        self.ensure_recurrence_window()
+        self.refresh_dashboard()
         # update the item widget
         self.update_item_widget()
         # update charts
@@ -178,6 +265,10 @@ class Controller:
         self.update_filter_report()
 
     def handle_end_date_selected(self):
+        # recurring events outside the materialized window change the totals,
+        # the charts are refreshed again once they are added
+        self.ensure_recurrence_window()
+        self.refresh_dashboard()
         # update the item widget
         self.update_item_widget()
         # charts
@@ -189,47 +280,49 @@ class Controller:
         self.update_filter_report()
 
     def handle_item_select(self):
+        self.refresh_dashboard(self.filter_view.item_var.get())
         self.update_stack_chart()
         self.update_filter_report()
 
-    def handle_read_calendars(self, file_path):
-        # 0. Remove old ics files
-        os.makedirs(ICS_DIR, exist_ok=True)
-
-        for ics_file in ICS_DIR.glob("*.ics"):
-            ics_file.unlink() # remove the file
-            print(f"File {ics_file} removed.")
+    def handle_import_progress(self, progress):
+        event = progress["event"]
+        if event == "import_started":
+            text = f"Importing {progress['total']} calendars..."
+        elif event == "calendar_skipped":
+            text = f"{progress['calendar']}: unchanged"
+        elif event == "calendar_written":
+            text = (
+                f"{progress['done']}/{progress['total']} {progress['calendar']}: "
+                f"{progress['events']} events"
+            )
+        elif event == "import_finished":
+            text = (
+                f"Imported {progress['events']} events in {progress['elapsed']:.1f}s "
+                f"({progress['skipped'] + progress['invalid']} skipped)"
+            )
+        elif event == "import_failed":
+            text = f"Import failed: {progress['error']}"
+        else:
+            return
+        self.action_view.update_status(text)
 
-        # Remove db
-        DB_FILE.unlink()
-        print(f"Remove db file {DB_FILE}")
+    def handle_read_calendars(self, file_path):
+        # Import calendars straight from the zip: members are streamed into
+        # the importer and only changed events are written, into the db in
+        # one transaction. Queries see the old data until it commits.
+        stats = converter.PipelineStats(callbacks=[self.handle_import_progress])
+        generation = self.db.generation
+        converter.import_zip(
+            file_path, incremental=True, stats=stats, dedupe=IMPORT_DEDUPE
+        )
 
-        with zipfile.ZipFile(file_path, 'r') as zip_file:
-            zip_file.extractall(ICS_DIR)
+        # Importer committed the new data, load its generation
+        self.db.swap()
 
-        print(f"ICS files extracted to: {ICS_DIR}")
-        
-        # Rename ics_files to clean name
-        for ics_file in ICS_DIR.glob("*.ics"):
-            if "Birthday" in str(ics_file):
-                ics_file.unlink()
-                print("Birthday calendar removed.")
-                continue
-            filename = ics_file.name.split("_")[0] + ".ics"
-            ics_file.rename(ICS_DIR / filename.lower())
-            print("Files renamed.")
-
-
-        # 3. create db file from ics files
-        converter.merge_to_one_db()
-
-        # Reopen database after creating new database
-        self.db.close()
-        self.db = DatabaseManager()
-        self.model = self.db.model
-
-        # 4. refresh the UI. calendars chart everything.
-        self.update_calendars_card()
+        # refresh the UI. calendars chart everything: cards for new
+        # calendars, none for pruned ones
+        self.refresh_calendars(self.model.calendars_changed_since(generation))
+        self.refresh_dashboard()
 
         # widgets
         self.update_item_widget()
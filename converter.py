@@ -1,26 +1,545 @@
+import hashlib
+import io
+import itertools
+import json
+from bisect import bisect_right
+import mmap
+import os
+import re
+import shutil
 import sqlite3
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from dataclasses import dataclass
 from icalendar import Calendar, Event
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
+from dateutil.rrule import rruleset, rrulestr
 import pytz
 from pathlib import Path
 
+from connections import connect, enable_wal, write_lock
+from snapshot import JULIAN_EPOCH, read_generation, write_snapshot
+
 BASE_DIR = Path(__file__).resolve().parent
 ICS_DIR = BASE_DIR / "ics"
 DB_DIR = BASE_DIR / "db"
+EXPORT_DIR = BASE_DIR / "export"
 SECONDS_PER_HOUR = 3600
+# Event rows buffered before each executemany in batch mode
+BATCH_SIZE = 5000
+# Pages install_database copies per backup step
+INSTALL_STEP_PAGES = 1024
+# Times a rebuild is imported again when another writer changed the live
+# database before it could be installed
+INSTALL_ATTEMPTS = 3
+
+CALENDAR_COLORS = {
+    "work": "#489160",
+    "saeed": "#7C7C7C",
+    "study": "#4B99D2",
+    "growth": "#A479B1",
+}
+
+# Properties the importer reads from a VEVENT
+DATE_PROPERTIES = ("dtstart", "dtend", "last-modified", "recurrence-id")
+# Date list properties, may repeat and hold comma separated values
+DATE_LIST_PROPERTIES = ("rdate", "exdate")
+TEXT_PROPERTIES = ("summary", "description", "location")
+
+# Recurring events are only materialized this many days around today until
+# a wider date range is asked for (see IcsToDb.extend_recurrence_window)
+RECURRENCE_WINDOW_DAYS = 365
+
+# Column order of the rows written to events. Parsed rows (see
+# IcsToDb.parse_event) use the same order without calendar_id and with
+# area/type/project names in place of their ids.
+EVENT_COLUMNS = (
+    "calendar_id",
+    "uid",
+    "recurrence_id",
+    "last_modified",
+    "area_id",
+    "type_id",
+    "project_id",
+    "summary",
+    "description",
+    "search_text",
+    "dtstart",
+    "dtend",
+    "date",
+    "day_number",
+    "duration",
+    "year",
+    "month",
+    "day",
+    "hour",
+    "minute",
+    "second",
+    "is_all_day",
+    "facets",
+    "content_hash",
+)
+INSERT_EVENT_SQL = (
+    f"INSERT INTO events ({', '.join(EVENT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in EVENT_COLUMNS)})"
+)
+INSERT_OR_IGNORE_EVENT_SQL = INSERT_EVENT_SQL.replace("INSERT", "INSERT OR IGNORE", 1)
+UPDATE_EVENT_SQL = (
+    f"UPDATE events SET {', '.join(f'{column} = ?' for column in EVENT_COLUMNS)} "
+    "WHERE id = ?"
+)
+
+# Columns added to events after the first release: (name, definition)
+EVENT_COLUMN_MIGRATIONS = (
+    ("uid", "TEXT"),
+    ("recurrence_id", "TEXT NOT NULL DEFAULT ''"),
+    ("last_modified", "TEXT"),
+    ("content_hash", "TEXT"),
+    ("facets", "TEXT"),
+    ("description", "TEXT"),
+    ("day_number", "INTEGER"),
+    ("search_text", "TEXT"),
+)
+# Columns filled from the ICS files only: when one of them is added, every
+# file is parsed again on the next import (see IcsToDb.init_db)
+REPARSE_COLUMNS = ("facets", "description", "search_text")
+MANIFEST_COLUMN_MIGRATIONS = (("generation", "INTEGER NOT NULL DEFAULT 0"),)
+
+# Description lines other than Area/Type/Project are stored as facets: any
+# "Key: value" line whose key matches FACET_KEY_PATTERN. Keys in
+# FACET_LIST_KEYS hold comma separated values, one facet each.
+DIMENSION_KEYS = ("area", "type", "project")
+FACET_KEY_PATTERN = re.compile(r"[a-z][a-z0-9 _-]{0,31}")
+FACET_LIST_KEYS = ("tags",)
+# daily_rollups kind -> SQL of its dimension id, over event_segments s JOIN
+# events e (and event_facets ef for facets)
+ROLLUP_KINDS = {
+    "area": "e.area_id",
+    "type": "e.type_id",
+    "project": "e.project_id",
+    "facet": "ef.facet_id",
+}
+
+# What the importer does with an event whose content hash (see
+# IcsToDb.event_hash) is already taken: keep it anyway, drop it if the same
+# calendar has it (re-exports) or if any calendar has it (blocks copied
+# between calendars; the copy stored or written first is kept)
+DEDUPE_POLICIES = ("keep", "calendar", "all")
+
+# Lines left out of a file's content digest: Google stamps every event with
+# the export time, so they change on each export even if no event did
+DIGEST_IGNORED_PREFIXES = (b"DTSTAMP",)
+
+# Events with their lookup names, for DbToIcs
+EXPORT_EVENTS_SQL = """
+    SELECT e.id, e.summary, e.dtstart, e.dtend, e.facets,
+           a.name AS area_name, t.name AS type_name, p.name AS project_name
+    FROM events e
+    LEFT JOIN areas a ON a.id = e.area_id
+    LEFT JOIN types t ON t.id = e.type_id
+    LEFT JOIN projects p ON p.id = e.project_id
+    {where}
+    ORDER BY e.dtstart
+"""
+
+
+UTC_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = NAIVE_EPOCH.toordinal()
+ONE_SECOND = timedelta(seconds=1)
+SECONDS_PER_DAY = 86400
+
+
+class TimezoneNormalizer:
+    """
+    Convert event datetimes to a calendar's local time. The timezone is
+    resolved once per calendar and its UTC offset transitions are cached
+    per name, so a conversion is a bisect plus integer arithmetic and the
+    dtstart string, date and components come out of one pass.
+    """
+
+    # timezone name -> (UTC transition epochs, UTC offsets in seconds)
+    offset_tables = {}
+
+    def __init__(self, tz_name):
+        self.tz_name = tz_name or ""
+        self.transitions, self.offsets = self.offset_table(self.tz_name)
+
+    @classmethod
+    def offset_table(cls, tz_name):
+        if tz_name not in cls.offset_tables:
+            cls.offset_tables[tz_name] = cls.build_offset_table(tz_name)
+        return cls.offset_tables[tz_name]
+
+    @staticmethod
+    def build_offset_table(tz_name):
+        """Read pytz's transition table; (None, None) keeps times unconverted"""
+        if not tz_name:
+            return None, None
+        try:
+            tz = pytz.timezone(tz_name)
+        except pytz.UnknownTimeZoneError:
+            print(f"Unknown timezone {tz_name}, times are not converted")
+            return None, None
+
+        transition_times = getattr(tz, "_utc_transition_times", None)
+        if not transition_times:
+            # Fixed offset zone (UTC, Etc/GMT+3, ...)
+            offset = tz.utcoffset(NAIVE_EPOCH)
+            return [-(2**63)], [offset // ONE_SECOND]
+
+        transitions = [(when - NAIVE_EPOCH) // ONE_SECOND for when in transition_times]
+        offsets = [info[0] // ONE_SECOND for info in tz._transition_info]
+        return transitions, offsets
+
+    def normalize(self, value):
+        """
+        Return (YYYYMMDDTHHMMSS or YYYYMMDD string, YYYY-MM-DD date,
+        (year, month, day, hour, minute, second)) for a date or datetime.
+        Naive datetimes are taken as UTC, like datetime_to_str does.
+        """
+        if value is None:
+            return None, None, (None, None, None, None, None, None)
+
+        if not isinstance(value, datetime):
+            # All-day event
+            year, month, day = value.year, value.month, value.day
+            return (
+                f"{year:04d}{month:02d}{day:02d}",
+                f"{year:04d}-{month:02d}-{day:02d}",
+                (year, month, day, 0, 0, 0),
+            )
+
+        if self.offsets is None:
+            # No calendar timezone: keep the wall-clock time as given
+            year, month, day = value.year, value.month, value.day
+            hour, minute, second = value.hour, value.minute, value.second
+        else:
+            if value.tzinfo is None:
+                epoch = (value - NAIVE_EPOCH) // ONE_SECOND
+            else:
+                epoch = (value - UTC_EPOCH) // ONE_SECOND
+            offset = self.offsets[bisect_right(self.transitions, epoch) - 1]
+            days, seconds = divmod(epoch + offset, SECONDS_PER_DAY)
+            local_date = date.fromordinal(EPOCH_ORDINAL + days)
+            year, month, day = local_date.year, local_date.month, local_date.day
+            hour, seconds = divmod(seconds, 3600)
+            minute, second = divmod(seconds, 60)
+
+        return (
+            f"{year:04d}{month:02d}{day:02d}T{hour:02d}{minute:02d}{second:02d}",
+            f"{year:04d}-{month:02d}-{day:02d}",
+            (year, month, day, hour, minute, second),
+        )
+
+
+@dataclass(frozen=True)
+class ZipMember:
+    """ICS file inside a zip archive, read without extracting it to disk"""
+
+    zip_path: str
+    name: str
+    calendar_name: str
+
+
+def calendar_name_of(ics_file):
+    """Calendar name of an ICS path or ZipMember"""
+    if isinstance(ics_file, ZipMember):
+        return ics_file.calendar_name
+    return Path(ics_file).stem
+
+
+class PipelineStats:
+    """
+    Instrumentation of an import or export run: seconds per stage, event
+    counts and progress events.
+
+    Subscribers are called with one dict per progress event, for example
+    {"event": "calendar_written", "calendar": "work", "done": 1, "total": 4,
+    "events": 391, "elapsed": 0.8}. With log_file set, progress events are
+    also appended to it as JSON lines.
+    """
+
+    def __init__(self, log_file=None, callbacks=()):
+        self.log_file = log_file
+        self.callbacks = list(callbacks)
+        # stage name (parse, normalize, lookup, insert, segments, facets,
+        # rollups, search, analyze, export) -> seconds
+        self.stage_times = {}
+        # events written, rows rejected by the database, events without
+        # dates, events dropped by the dedupe policy
+        self.counts = {"events": 0, "skipped": 0, "invalid": 0, "duplicates": 0}
+        self.started = perf_counter()
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def add_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other):
+        """Add the times and counts of a worker process's stats"""
+        for stage, seconds in other.stage_times.items():
+            self.add_time(stage, seconds)
+        for name, n in other.counts.items():
+            if name != "events":
+                self.count(name, n)
+
+    def summary(self):
+        elapsed = perf_counter() - self.started
+        return {
+            "elapsed": elapsed,
+            "events_per_sec": self.counts["events"] / elapsed if elapsed else 0,
+            "stage_times": dict(self.stage_times),
+            **self.counts,
+        }
+
+    def emit(self, event, **fields):
+        """Send a progress event to subscribers and the log file"""
+        progress = {"event": event, "elapsed": perf_counter() - self.started, **fields}
+        for callback in self.callbacks:
+            callback(progress)
+        if self.log_file:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(progress) + "\n")
+
+    def __getstate__(self):
+        # Callbacks stay in the parent process
+        return {**self.__dict__, "callbacks": []}
+
+
+class IcsStreamReader:
+    """Read VEVENTs one at a time from an ICS file without building a Calendar"""
+
+    def __init__(self, source, digest=None):
+        # source is a path (memory-mapped) or a binary file object
+        self.source = source
+        # hashlib object updated with the lines read, see content_digest
+        self.digest = digest
+        self.properties = {}
+        self._contents = None
+        self._pending = None
+
+    def physical_lines(self):
+        """Yield raw lines from the memory-mapped file or file object"""
+        if hasattr(self.source, "readline"):
+            yield from self.digested(iter(self.source.readline, b""))
+            return
+
+        with open(self.source, "rb") as f:
+            # mmap can't map an empty file
+            if not f.seek(0, 2):
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from self.digested(iter(mm.readline, b""))
+
+    def digested(self, lines):
+        """Yield lines, adding all but DIGEST_IGNORED_PREFIXES ones to self.digest"""
+        if self.digest is None:
+            yield from lines
+            return
+        for line in lines:
+            if not line.startswith(DIGEST_IGNORED_PREFIXES):
+                self.digest.update(line)
+            yield line
+
+    def lines(self):
+        """Yield logical lines with RFC 5545 folding undone"""
+        pending = None
+        for raw in self.physical_lines():
+            line = raw.rstrip(b"\r\n")
+            # Folded line: continuation starts with a single space or tab
+            if line[:1] in (b" ", b"\t"):
+                if pending is not None:
+                    pending += line[1:]
+                continue
+            if pending:
+                yield pending.decode("utf-8", "replace")
+            pending = line
+        if pending:
+            yield pending.decode("utf-8", "replace")
+
+    def parse_content_line(self, line):
+        """Split `NAME;PARAM=VALUE:value` into name, params and value"""
+        head, _, value = line.partition(":")
+        if '"' in head:
+            # Quoted parameter values may contain ':'
+            in_quotes = False
+            for i, char in enumerate(line):
+                if char == '"':
+                    in_quotes = not in_quotes
+                elif char == ":" and not in_quotes:
+                    head, value = line[:i], line[i + 1 :]
+                    break
+
+        name, *param_parts = head.split(";")
+        params = {}
+        for part in param_parts:
+            key, _, param_value = part.partition("=")
+            params[key.upper()] = param_value.strip('"')
+        return name.upper(), params, value
+
+    def unescape_text(self, value):
+        """Undo TEXT escaping: \\n, \\N, \\,, \\; and \\\\"""
+        if "\\" not in value:
+            return value
+        out = []
+        chars = iter(value)
+        for char in chars:
+            if char == "\\":
+                char = next(chars, "")
+                out.append("\n" if char in ("n", "N") else char)
+            else:
+                out.append(char)
+        return "".join(out)
+
+    def parse_datetime(self, value, params):
+        """Convert DATE or DATE-TIME value to date/datetime object"""
+        value = value.strip()
+        if len(value) == 8 or params.get("VALUE") == "DATE":
+            return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+        dt = datetime(
+            int(value[0:4]),
+            int(value[4:6]),
+            int(value[6:8]),
+            int(value[9:11]),
+            int(value[11:13]),
+            int(value[13:15]),
+        )
+        if value.endswith("Z"):
+            return pytz.utc.localize(dt)
+
+        tzid = params.get("TZID")
+        if tzid:
+            try:
+                return pytz.timezone(tzid).localize(dt)
+            except pytz.UnknownTimeZoneError:
+                pass
+        # Floating time
+        return dt
+
+    def decode_value(self, name, params, value):
+        """Decode property value the same way icalendar would"""
+        if name in DATE_PROPERTIES:
+            try:
+                return self.parse_datetime(value, params)
+            except (ValueError, IndexError):
+                return None
+        if name in DATE_LIST_PROPERTIES:
+            values = []
+            for item in value.split(","):
+                # PERIOD values (start/end or start/duration): keep the start
+                item = item.split("/")[0]
+                try:
+                    values.append(self.parse_datetime(item, params))
+                except (ValueError, IndexError):
+                    pass
+            return values
+        if name in TEXT_PROPERTIES:
+            return self.unescape_text(value)
+        return value
+
+    def content_lines(self):
+        for line in self.lines():
+            if line:
+                yield self.parse_content_line(line)
+
+    def read_header(self):
+        """Read calendar properties that precede the first component"""
+        if self._contents is None:
+            self._contents = self.content_lines()
+
+        for name, params, value in self._contents:
+            if name == "BEGIN" and value.upper() != "VCALENDAR":
+                self._pending = (name, params, value)
+                break
+            if name not in ("BEGIN", "END"):
+                self.properties[name.lower()] = self.unescape_text(value)
+        return self.properties
+
+    def events(self):
+        """Yield one dict of decoded properties per VEVENT"""
+        if self._contents is None:
+            self.read_header()
+
+        contents = self._contents
+        if self._pending:
+            contents = itertools.chain([self._pending], contents)
+            self._pending = None
+
+        stack = ["VCALENDAR"]
+        event = None
+        for name, params, value in contents:
+            if name == "BEGIN":
+                stack.append(value.upper())
+                if stack[-1] == "VEVENT":
+                    event = {}
+            elif name == "END":
+                if stack[-1] == "VEVENT" and event is not None:
+                    yield event
+                    event = None
+                if len(stack) > 1:
+                    stack.pop()
+            elif stack[-1] == "VEVENT":
+                key = name.lower()
+                if key in DATE_LIST_PROPERTIES:
+                    event.setdefault(key, []).extend(
+                        self.decode_value(key, params, value)
+                    )
+                else:
+                    event[key] = self.decode_value(key, params, value)
+            elif len(stack) == 1:
+                self.properties[name.lower()] = self.unescape_text(value)
 
 
 class IcsToDb:
     """Convert ICS file to SQLite database with normalized schema"""
 
-    def __init__(self, db_file="calendar.db"):
+    def __init__(
+        self,
+        db_file="calendar.db",
+        streaming=False,
+        batch_size=None,
+        recurrence_window=None,
+        stats=None,
+        dedupe="keep",
+    ):
+        if dedupe not in DEDUPE_POLICIES:
+            raise ValueError(f"Unknown dedupe policy {dedupe!r}")
         self.db_file = db_file
         self.conn = None
         self.calendar_timezone = None
+        self.normalizer = TimezoneNormalizer(None)
+        # (start, end) dates to materialize recurring events for, defaults
+        # to the window stored in the database
+        self.recurrence_window = recurrence_window
+        self.parsed_series = []
+        # content_digest of the last file parsed, set once it is read through
+        self.parsed_digest = None
+        # Stream VEVENTs from a memory-mapped file instead of parsing the whole Calendar
+        self.streaming = streaming
+        # Batch mode: cache dimension ids for the whole run and write event
+        # rows with executemany, batch_size rows at a time
+        self.batch_size = batch_size
+        self.dimension_cache = None
+        self.pending_rows = {}
+        self.stats = stats or PipelineStats()
+        # Generation of the change being written (see bump_generation)
+        self.generation = 0
+        # calendar name -> (source, size, mtime, digest) of files being imported
+        self.fingerprints = {}
+        # One of DEDUPE_POLICIES
+        self.dedupe = dedupe
 
     def init_db(self):
         """Initialize database with normalized schema"""
-        self.conn = sqlite3.connect(self.db_file)
+        self.conn = connect(self.db_file)
         cursor = self.conn.cursor()
 
         # Enable foreign keys
@@ -81,6 +600,7 @@ class IcsToDb:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 calendar_id INTEGER NOT NULL,
                 summary TEXT NOT NULL,
+                description TEXT,
                 dtstart TEXT NOT NULL,
                 dtend TEXT NOT NULL,
                 date TEXT NOT NULL,
@@ -95,6 +615,13 @@ class IcsToDb:
                 project_id INTEGER,
                 type_id INTEGER,
                 is_all_day INTEGER DEFAULT 0,
+                uid TEXT,
+                recurrence_id TEXT NOT NULL DEFAULT '',
+                last_modified TEXT,
+                content_hash TEXT,
+                facets TEXT,
+                day_number INTEGER,
+                search_text TEXT,
                 FOREIGN KEY (calendar_id) REFERENCES calendars(id) ON DELETE CASCADE,
                 FOREIGN KEY (area_id) REFERENCES areas(id),
                 FOREIGN KEY (project_id) REFERENCES projects(id),
@@ -102,6 +629,18 @@ class IcsToDb:
             )
         """
         )
+        added = self.migrate_table(cursor, "events", EVENT_COLUMN_MIGRATIONS)
+        if "content_hash" in added:
+            # Database from before content hashes
+            self.backfill_event_hashes(cursor)
+        if "day_number" in added:
+            # Database from before day numbers
+            cursor.execute(
+                f"""
+                UPDATE events
+                SET day_number = CAST(julianday(date) - {JULIAN_EPOCH} AS INTEGER)
+                """
+            )
 
         # Create indexes
         cursor.execute(
@@ -127,9 +666,358 @@ class IcsToDb:
         cursor.execute(
             "CREATE INDEX IF NOT EXISTS idx_events_year_month ON events(year, month)"
         )
+        # One row per occurrence: a recurring series shares its UID with its
+        # occurrences and overrides, RECURRENCE-ID tells them apart
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_events_uid
+            ON events(calendar_id, uid, recurrence_id)
+            """
+        )
+        # Dashboard range aggregates (calendar, day range, hours per
+        # area/type/project) are answered from this index without reading
+        # events rows. One index for all three dimensions: the day range
+        # comes first, so per-dimension indexes would not save the GROUP BY.
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_events_calendar_day
+            ON events(calendar_id, day_number, area_id, type_id, project_id, duration)
+            """
+        )
+        # Copies of the same event, within or across calendars, share a
+        # content hash; covers CalendarModel.get_duplicate_events
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_events_content_hash
+            ON events(content_hash, calendar_id, duration)
+            """
+        )
+
+        # Hours and event counts per calendar, day and area/type/project/facet,
+        # so dashboard range queries read days instead of events. total_hours
+        # and event_count count events in full on the day they start,
+        # segment_hours and segment_count the hours each day when split at
+        # midnight, max/min_duration the longest and shortest of those events.
+        # Days whose events changed are queued in rollup_stale_days and
+        # recomputed by sync_rollups.
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_rollups'"
+        )
+        rollups_exist = cursor.fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                calendar_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                day_number INTEGER NOT NULL,
+                dimension_id INTEGER NOT NULL,
+                total_hours REAL NOT NULL,
+                event_count INTEGER NOT NULL,
+                segment_hours REAL NOT NULL,
+                segment_count INTEGER NOT NULL,
+                max_duration REAL NOT NULL,
+                min_duration REAL NOT NULL,
+                PRIMARY KEY (calendar_id, kind, day_number, dimension_id)
+            ) WITHOUT ROWID
+        """
+        )
+        # Covers the daily duration and report queries of one
+        # area/type/project/facet
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_daily_rollups_dimension
+            ON daily_rollups(
+                calendar_id, kind, dimension_id, day_number,
+                segment_hours, segment_count, max_duration, min_duration
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_stale_days (
+                calendar_id INTEGER NOT NULL,
+                day_number INTEGER NOT NULL,
+                PRIMARY KEY (calendar_id, day_number)
+            ) WITHOUT ROWID
+        """
+        )
+
+        # Events split at local midnight: one row per day an event covers,
+        # with the hours it takes that day (see IcsToDb.sync_segments)
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_segments'"
+        )
+        segments_exist = cursor.fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS event_segments (
+                event_id INTEGER NOT NULL,
+                calendar_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                duration REAL NOT NULL,
+                PRIMARY KEY (event_id, date),
+                FOREIGN KEY (event_id) REFERENCES events(id) ON DELETE CASCADE
+            )
+        """
+        )
+        # Covers the daily duration and report queries
+        cursor.execute("DROP INDEX IF EXISTS idx_event_segments_calendar_date")
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_event_segments_calendar_date_event
+            ON event_segments(calendar_id, date, event_id, duration)
+            """
+        )
+        # Segments of changed events are dropped here and rebuilt by sync_segments
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS events_update_segments
+            AFTER UPDATE OF calendar_id, dtstart, dtend, duration, is_all_day ON events
+            BEGIN
+                DELETE FROM event_segments WHERE event_id = OLD.id;
+            END
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS events_delete_segments
+            AFTER DELETE ON events
+            BEGIN
+                DELETE FROM event_segments WHERE event_id = OLD.id;
+            END
+            """
+        )
+        # Days losing segments, and days of events moved to another
+        # area/type/project or facet, are queued for sync_rollups. Days
+        # gaining segments are queued by sync_segments.
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS event_segments_delete_rollups
+            AFTER DELETE ON event_segments
+            BEGIN
+                INSERT OR IGNORE INTO rollup_stale_days (calendar_id, day_number)
+                VALUES (
+                    OLD.calendar_id,
+                    CAST(julianday(OLD.date) - {JULIAN_EPOCH} AS INTEGER)
+                );
+            END
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS events_update_rollups
+            AFTER UPDATE OF area_id, type_id, project_id, facets ON events
+            BEGIN
+                INSERT OR IGNORE INTO rollup_stale_days (calendar_id, day_number)
+                SELECT calendar_id, CAST(julianday(date) - {JULIAN_EPOCH} AS INTEGER)
+                FROM event_segments WHERE event_id = OLD.id;
+            END
+            """
+        )
+        if not segments_exist:
+            # Database from before event_segments
+            self.sync_segments(cursor)
+
+        # Description "Key: value" lines other than area/type/project, and
+        # the events that have them. events.facets holds an event's
+        # [key, value] pairs as JSON (see IcsToDb.sync_facets).
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS facets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                UNIQUE (key, value)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS event_facets (
+                event_id INTEGER NOT NULL,
+                facet_id INTEGER NOT NULL,
+                PRIMARY KEY (event_id, facet_id),
+                FOREIGN KEY (event_id) REFERENCES events(id) ON DELETE CASCADE,
+                FOREIGN KEY (facet_id) REFERENCES facets(id)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_event_facets_facet_id
+            ON event_facets(facet_id, event_id)
+            """
+        )
+        # Links of changed events are dropped here and rebuilt by sync_facets
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS events_update_facets
+            AFTER UPDATE OF facets ON events
+            BEGIN
+                DELETE FROM event_facets WHERE event_id = OLD.id;
+            END
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS events_delete_facets
+            AFTER DELETE ON events
+            BEGIN
+                DELETE FROM event_facets WHERE event_id = OLD.id;
+            END
+            """
+        )
+
+        if not rollups_exist:
+            # Database from before daily_rollups
+            cursor.execute(
+                f"""
+                INSERT OR IGNORE INTO rollup_stale_days (calendar_id, day_number)
+                SELECT DISTINCT calendar_id,
+                       CAST(julianday(date) - {JULIAN_EPOCH} AS INTEGER)
+                FROM event_segments
+                """
+            )
+            self.sync_rollups(cursor)
+
+        # Recurring series masters, expanded into events for the window
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recurrences (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                calendar_id INTEGER NOT NULL,
+                uid TEXT NOT NULL,
+                master TEXT NOT NULL,
+                UNIQUE (calendar_id, uid),
+                FOREIGN KEY (calendar_id) REFERENCES calendars(id) ON DELETE CASCADE
+            )
+        """
+        )
+
+        # Fingerprint of the file each calendar was last imported from, so
+        # unchanged files can be skipped (see IcsToDb.changed_files), and the
+        # generation that import made, so readers can tell what changed
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifest (
+                calendar_id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                event_count INTEGER NOT NULL,
+                generation INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (calendar_id) REFERENCES calendars(id) ON DELETE CASCADE
+            )
+        """
+        )
+        self.migrate_table(cursor, "manifest", MANIFEST_COLUMN_MIGRATIONS)
+        if set(REPARSE_COLUMNS) & set(added):
+            # Database from before facets, descriptions or search text: make
+            # the next import parse every file and rewrite every event
+            cursor.execute("DELETE FROM manifest")
+            cursor.execute("UPDATE events SET last_modified = NULL")
+
+        # Key/value settings (recurrence window, generation, search index mark)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """
+        )
+
+        # Full-text index of event summaries and descriptions (search_text:
+        # without their "Key:" labels), reading the text from events
+        # (external content). Events up to the 'search_indexed_id' setting
+        # are indexed: new ones are added in bulk by sync_search_index,
+        # triggers update the index for indexed ones. Prefix indexes make
+        # "term*" queries cheap for search as you type.
+        cursor.execute("SELECT name FROM pragma_table_info('events_fts')")
+        fts_columns = {row[0] for row in cursor.fetchall()}
+        if "description" in fts_columns:
+            # Index from before search_text, labels and all: built again
+            cursor.execute("DROP TRIGGER IF EXISTS events_update_fts")
+            cursor.execute("DROP TRIGGER IF EXISTS events_delete_fts")
+            cursor.execute("DROP TABLE events_fts")
+            fts_columns = set()
+        cursor.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+                summary,
+                search_text,
+                content = 'events',
+                content_rowid = 'id',
+                prefix = '2 3',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """
+        )
+        indexed = """
+            OLD.id <= (SELECT value FROM settings WHERE key = 'search_indexed_id')
+        """
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS events_update_fts
+            AFTER UPDATE OF summary, search_text ON events WHEN {indexed}
+            BEGIN
+                INSERT INTO events_fts (events_fts, rowid, summary, search_text)
+                VALUES ('delete', OLD.id, OLD.summary, OLD.search_text);
+                INSERT INTO events_fts (rowid, summary, search_text)
+                VALUES (NEW.id, NEW.summary, NEW.search_text);
+            END
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS events_delete_fts
+            AFTER DELETE ON events WHEN {indexed}
+            BEGIN
+                INSERT INTO events_fts (events_fts, rowid, summary, search_text)
+                VALUES ('delete', OLD.id, OLD.summary, OLD.search_text);
+            END
+            """
+        )
+        if not fts_columns:
+            # Database from before events_fts
+            cursor.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+            self.set_search_indexed_id(cursor)
 
         self.conn.commit()
 
+    def migrate_table(self, cursor, table_name, migrations):
+        """
+        Add columns missing from a table created by an older version,
+        return the names of the columns added
+        """
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns = {row[1] for row in cursor.fetchall()}
+        added = []
+        for name, definition in migrations:
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {name} {definition}")
+                added.append(name)
+        return added
+
+    def backfill_event_hashes(self, cursor):
+        """Compute the content hash of events stored without one"""
+        cursor.execute(
+            """
+            SELECT e.id, e.summary, e.dtstart, e.dtend,
+                   a.name, t.name, p.name
+            FROM events e
+            LEFT JOIN areas a ON a.id = e.area_id
+            LEFT JOIN types t ON t.id = e.type_id
+            LEFT JOIN projects p ON p.id = e.project_id
+            WHERE e.content_hash IS NULL
+            """
+        )
+        cursor.executemany(
+            "UPDATE events SET content_hash = ? WHERE id = ?",
+            [(self.event_hash(*row[1:]), row[0]) for row in cursor.fetchall()],
+        )
+
     def get_or_create_lookup_id(self, cursor, table_name, field_name, value):
         """Get or create ID in a lookup table"""
         if not value:
@@ -209,6 +1097,330 @@ class IcsToDb:
             )
             return cursor.lastrowid
 
+    def load_dimension_cache(self, cursor):
+        """Load name -> id maps of all lookup tables for batch mode"""
+        self.dimension_cache = {}
+        for table_name in ("areas", "types", "projects"):
+            cursor.execute(f"SELECT name, id FROM {table_name}")
+            self.dimension_cache[table_name] = dict(cursor.fetchall())
+
+    def cached_lookup_id(self, cursor, table_name, name, area_name=None):
+        """Resolve lookup name from the cache, hitting SQLite only for new names"""
+        if not name:
+            return None
+        key = name.strip().lower()
+        if not key:
+            return None
+
+        cache = self.dimension_cache[table_name]
+        if key not in cache:
+            if table_name == "types":
+                cache[key] = self.get_or_create_type_id(cursor, key, area_name)
+            elif table_name == "projects":
+                cache[key] = self.get_or_create_project_id(cursor, key, area_name)
+            else:
+                cache[key] = self.get_or_create_lookup_id(
+                    cursor, table_name, "name", key
+                )
+        return cache[key]
+
+    def dimension_ids(self, cursor, area, type_name, project):
+        """Return (area_id, type_id, project_id) for description field values"""
+        if self.batch_size:
+            if self.dimension_cache is None:
+                self.load_dimension_cache(cursor)
+            return (
+                self.cached_lookup_id(cursor, "areas", area),
+                self.cached_lookup_id(cursor, "types", type_name, area),
+                self.cached_lookup_id(cursor, "projects", project, area),
+            )
+
+        area_id = self.get_or_create_lookup_id(cursor, "areas", "name", area)
+        type_id = self.get_or_create_type_id(cursor, type_name, area)
+        project_id = self.get_or_create_project_id(cursor, project, area)
+        return area_id, type_id, project_id
+
+    def timed(self, stage, func, *args):
+        """Call func, adding its run time to stage"""
+        start = perf_counter()
+        result = func(*args)
+        self.stats.add_time(stage, perf_counter() - start)
+        return result
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, adding the time spent producing items to stage"""
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            item = next(iterator, None)
+            self.stats.add_time(stage, perf_counter() - start)
+            if item is None:
+                return
+            yield item
+
+    def write_row(self, cursor, sql, values):
+        """Write one event row now, or buffer it for executemany in batch mode"""
+        if self.batch_size:
+            rows = self.pending_rows.setdefault(sql, [])
+            rows.append(values)
+            if len(rows) >= self.batch_size:
+                self.flush_rows(cursor)
+            return True
+
+        try:
+            self.timed("insert", cursor.execute, sql, values)
+            return True
+        except sqlite3.IntegrityError:
+            self.stats.count("skipped")
+            return False
+
+    def flush_rows(self, cursor):
+        """Write buffered rows with executemany, row by row if a batch fails"""
+        if not self.pending_rows:
+            return
+        self.timed("insert", self.write_pending_rows, cursor)
+
+    def write_pending_rows(self, cursor):
+        # Keep the whole import in one transaction: RELEASE of an outer
+        # savepoint would commit it
+        if not self.conn.in_transaction:
+            cursor.execute("BEGIN")
+
+        for sql, rows in self.pending_rows.items():
+            if not rows:
+                continue
+            cursor.execute("SAVEPOINT batch")
+            try:
+                cursor.executemany(sql, rows)
+            except sqlite3.IntegrityError:
+                cursor.execute("ROLLBACK TO batch")
+                for values in rows:
+                    try:
+                        cursor.execute(sql, values)
+                    except sqlite3.IntegrityError:
+                        self.stats.count("skipped")
+            cursor.execute("RELEASE batch")
+        self.pending_rows = {}
+
+    def sync_segments(self, cursor, calendar_id=None):
+        """Split events without segments (new or changed) into event_segments"""
+        scope = "e.calendar_id = ?" if calendar_id else "1"
+        params = (calendar_id,) if calendar_id else ()
+        missing = (
+            f"{scope} AND NOT EXISTS "
+            "(SELECT 1 FROM event_segments s WHERE s.event_id = e.id)"
+        )
+
+        # Days the new segments add to (see sync_rollups): every event has a
+        # segment on the day it starts, later days are queued below
+        cursor.execute(
+            f"""
+            INSERT OR IGNORE INTO rollup_stale_days (calendar_id, day_number)
+            SELECT DISTINCT e.calendar_id, e.day_number FROM events e
+            WHERE {missing}
+            """,
+            params,
+        )
+
+        # Most events end the day they start and need no splitting
+        cursor.execute(
+            f"""
+            INSERT INTO event_segments (event_id, calendar_id, date, duration)
+            SELECT e.id, e.calendar_id, e.date, e.duration FROM events e
+            WHERE {missing}
+              AND e.is_all_day = 0
+              AND SUBSTR(e.dtend, 1, 8) <= SUBSTR(e.dtstart, 1, 8)
+            """,
+            params,
+        )
+
+        cursor.execute(
+            f"""
+            SELECT e.id, e.calendar_id, e.dtstart, e.dtend, e.is_all_day, e.duration
+            FROM events e WHERE {missing}
+            """,
+            params,
+        )
+        segments = [
+            (event_id, event_calendar_id, day, hours)
+            for event_id, event_calendar_id, dtstart, dtend, is_all_day, duration in (
+                cursor.fetchall()
+            )
+            for day, hours in self.day_segments(dtstart, dtend, is_all_day, duration)
+        ]
+        cursor.executemany(
+            """
+            INSERT INTO event_segments (event_id, calendar_id, date, duration)
+            VALUES (?, ?, ?, ?)
+            """,
+            segments,
+        )
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO rollup_stale_days (calendar_id, day_number)
+            VALUES (?, ?)
+            """,
+            {
+                (event_calendar_id, date.fromisoformat(day).toordinal() - EPOCH_ORDINAL)
+                for _, event_calendar_id, day, _ in segments
+            },
+        )
+
+    def sync_facets(self, cursor, calendar_id=None):
+        """Link events with facets but no event_facets rows (new or changed)"""
+        scope = "e.calendar_id = ?" if calendar_id else "1"
+        params = (calendar_id,) if calendar_id else ()
+        # [key, value] pairs of those events
+        pairs = f"""
+            SELECT e.id AS event_id,
+                   json_extract(j.value, '$[0]') AS key,
+                   json_extract(j.value, '$[1]') AS value
+            FROM events e, json_each(e.facets) j
+            WHERE {scope} AND e.facets IS NOT NULL
+              AND NOT EXISTS
+                  (SELECT 1 FROM event_facets ef WHERE ef.event_id = e.id)
+        """
+        cursor.execute(
+            f"""
+            INSERT INTO facets (key, value)
+            SELECT DISTINCT p.key, p.value FROM ({pairs}) p
+            WHERE NOT EXISTS
+                (SELECT 1 FROM facets f WHERE f.key = p.key AND f.value = p.value)
+            """,
+            params,
+        )
+        cursor.execute(
+            f"""
+            INSERT OR IGNORE INTO event_facets (event_id, facet_id)
+            SELECT p.event_id, f.id FROM ({pairs}) p
+            JOIN facets f ON f.key = p.key AND f.value = p.value
+            """,
+            params,
+        )
+
+    def sync_rollups(self, cursor):
+        """
+        Recompute the daily_rollups rows of the days in rollup_stale_days.
+        CROSS JOIN keeps the stale days as the outer loop: with statistics
+        for a large events table the planner would rather scan all of it.
+        """
+        for kind, dimension_id in ROLLUP_KINDS.items():
+            cursor.execute(
+                """
+                DELETE FROM daily_rollups
+                WHERE kind = ? AND (calendar_id, day_number) IN
+                    (SELECT calendar_id, day_number FROM rollup_stale_days)
+                """,
+                (kind,),
+            )
+            facets = (
+                "CROSS JOIN event_facets ef ON ef.event_id = s.event_id"
+                if kind == "facet"
+                else ""
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO daily_rollups (
+                    calendar_id, kind, day_number, dimension_id,
+                    total_hours, event_count, segment_hours, segment_count,
+                    max_duration, min_duration
+                )
+                SELECT
+                    d.calendar_id,
+                    ?,
+                    d.day_number,
+                    {dimension_id},
+                    SUM(CASE WHEN s.date = e.date THEN e.duration ELSE 0 END),
+                    SUM(s.date = e.date),
+                    SUM(s.duration),
+                    COUNT(*),
+                    MAX(e.duration),
+                    MIN(e.duration)
+                FROM rollup_stale_days d
+                CROSS JOIN event_segments s
+                    ON s.calendar_id = d.calendar_id
+                    AND s.date = date(d.day_number + {JULIAN_EPOCH})
+                CROSS JOIN events e ON e.id = s.event_id
+                {facets}
+                WHERE {dimension_id} IS NOT NULL
+                GROUP BY d.calendar_id, d.day_number, {dimension_id}
+                """,
+                (kind,),
+            )
+        cursor.execute("DELETE FROM rollup_stale_days")
+
+    def sync_search_index(self, cursor):
+        """Add events inserted since the last call to events_fts"""
+        cursor.execute(
+            """
+            INSERT INTO events_fts (rowid, summary, search_text)
+            SELECT id, summary, search_text FROM events
+            WHERE id > COALESCE(
+                (SELECT value FROM settings WHERE key = 'search_indexed_id'), 0
+            )
+            """
+        )
+        self.set_search_indexed_id(cursor)
+
+    def set_search_indexed_id(self, cursor):
+        # Event ids are AUTOINCREMENT, so events inserted later get higher ids
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO settings (key, value)
+            SELECT 'search_indexed_id', COALESCE(MAX(id), 0) FROM events
+            """
+        )
+
+    def day_segments(self, dtstart, dtend, is_all_day, duration):
+        """
+        Split an event at local midnight into (YYYY-MM-DD, hours) per day.
+        dtstart and dtend are the local time strings stored in events.
+        All-day events cover each day up to dtend with 0 hours.
+        """
+        start = self.local_datetime(dtstart)
+        end = self.local_datetime(dtend)
+        if is_all_day:
+            days = max((end - start).days, 1)
+            return [
+                ((start + timedelta(days=i)).strftime("%Y-%m-%d"), 0)
+                for i in range(days)
+            ]
+
+        segments = []
+        current = start
+        while True:
+            midnight = datetime.combine(current.date() + timedelta(days=1), time())
+            if end <= midnight:
+                segments.append((current.strftime("%Y-%m-%d"), 0))
+                break
+            hours = (midnight - current).total_seconds() / SECONDS_PER_HOUR
+            segments.append((current.strftime("%Y-%m-%d"), hours))
+            current = midnight
+
+        # The last day gets the rest of duration: it is elapsed time, which
+        # differs from wall-clock time across a DST change
+        day, _ = segments[-1]
+        segments[-1] = (day, duration - sum(hours for _, hours in segments[:-1]))
+        return segments
+
+    def local_datetime(self, value):
+        """Parse a YYYYMMDD or YYYYMMDDTHHMMSS string from events"""
+        if len(value) == 8:
+            return datetime.strptime(value, "%Y%m%d")
+        return datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+
+    def event_hash(self, summary, dtstart, dtend, area, type_name, project):
+        """
+        Content hash of an event: its summary (case and whitespace
+        normalized), local start and end and area/type/project names. Equal
+        for copies of an event whatever their calendar or UID.
+        """
+        summary = " ".join((summary or "").split()).casefold()
+        content = "\x1f".join(
+            [summary, dtstart or "", dtend or "", area or "", type_name or "", project or ""]
+        )
+        return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
     def strip_html_tags(self, text):
         """Remove HTML tags from text, replacing <br> with newlines"""
         import re
@@ -224,11 +1436,19 @@ class IcsToDb:
         return text
 
     def parse_description(self, desc):
-        """Parse structured description into fields (only area, type, project)"""
+        """
+        Parse structured description into area, type and project fields,
+        "facets", the (key, value) pairs of its other "Key: value" lines,
+        "text", the description without HTML, and "search_text", the text
+        with the keys of those lines left out, for the full-text index
+        """
         fields = {
             "area": None,
             "type": None,
             "project": None,
+            "facets": [],
+            "text": None,
+            "search_text": None,
         }
 
         if not desc:
@@ -236,15 +1456,27 @@ class IcsToDb:
 
         # Remove HTML tags first
         desc = self.strip_html_tags(desc)
+        fields["text"] = desc
 
+        search_lines = []
         for line in desc.split("\n"):
             if ":" in line:
-                key, value = line.split(":", 1)
+                key, raw_value = line.split(":", 1)
                 key = key.strip().lower()
-                value = value.strip().lower()  # Convert to lowercase
+                value = raw_value.strip().lower()  # Convert to lowercase
 
-                if key in fields:
+                if key in DIMENSION_KEYS:
                     fields[key] = value
+                    # "area" or "type" would match every event
+                    line = raw_value
+                elif value and FACET_KEY_PATTERN.fullmatch(key):
+                    values = value.split(",") if key in FACET_LIST_KEYS else [value]
+                    fields["facets"].extend(
+                        (key, item.strip()) for item in values if item.strip()
+                    )
+                    line = raw_value
+            search_lines.append(line)
+        fields["search_text"] = "\n".join(search_lines)
 
         return fields
 
@@ -330,22 +1562,279 @@ class IcsToDb:
 
         return dt.strftime("%Y%m%dT%H%M%S")
 
-    def import_calendar(self, ics_file, color=None):
-        """Import ICS file to SQLite database with normalized schema"""
+    def component_fields(self, component):
+        """Flatten an icalendar VEVENT into the dict IcsStreamReader yields"""
+        fields = {}
+        for name, value in component.property_items(recursive=False):
+            key = name.lower()
+            if key in DATE_PROPERTIES:
+                fields[key] = value.dt if hasattr(value, "dt") else None
+            elif key in DATE_LIST_PROPERTIES:
+                fields.setdefault(key, []).extend(item.dt for item in value.dts)
+            elif key == "rrule":
+                fields[key] = value.to_ical().decode()
+            elif key not in ("begin", "end"):
+                fields[key] = str(value)
+        return fields
+
+    def read_events(self, ics_file):
+        """Yield (calendar properties, event fields) from ICS file"""
+        if isinstance(ics_file, ZipMember):
+            with zipfile.ZipFile(ics_file.zip_path) as zip_file:
+                with zip_file.open(ics_file.name) as member:
+                    yield from self.read_stream_events(member)
+            return
+
+        if self.streaming:
+            yield from self.read_stream_events(ics_file)
+            return
+
         with open(ics_file, "rb") as f:
-            cal = Calendar.from_ical(f.read())
+            data = f.read()
+        self.parsed_digest = content_digest(io.BytesIO(data))
+        cal = Calendar.from_ical(data)
 
-        self.init_db()
-        cursor = self.conn.cursor()
+        properties = {"x-wr-timezone": str(cal.get("x-wr-timezone", ""))}
+        for component in cal.walk():
+            if component.name == "VEVENT":
+                yield properties, self.component_fields(component)
+
+    def read_stream_events(self, source):
+        """Yield (calendar properties, event fields) with IcsStreamReader"""
+        digest = hashlib.blake2b(digest_size=16)
+        reader = IcsStreamReader(source, digest)
+        properties = reader.read_header()
+        for fields in reader.events():
+            yield properties, fields
+        self.parsed_digest = digest.hexdigest()
+
+    def event_key(self, fields):
+        """Return (uid, recurrence_id, last_modified) identifying a VEVENT version"""
+        uid = fields.get("uid") or None
+        recurrence_id = self.normalizer.normalize(fields.get("recurrence-id"))[0]
+        last_modified = self.datetime_to_str(fields.get("last-modified"))
+        return uid, recurrence_id or "", last_modified
+
+    def parse_event(self, fields):
+        """
+        Build a parsed row from decoded VEVENT fields. Parsed rows are plain
+        tuples in EVENT_COLUMNS order (without calendar_id) holding the
+        area/type/project names, so they need no database and can be sent
+        between processes.
+        """
+        desc_fields = self.parse_description(fields.get("description", ""))
+
+        dtstart = fields.get("dtstart")
+        dtend = fields.get("dtend")
+        is_all_day = 0
+        if dtstart and not isinstance(dtstart, datetime):
+            is_all_day = 1
+
+        # Convert to calendar timezone: string, YYYY-MM-DD date and datetime
+        # components in one pass
+        dtstart_str, date_str, components = self.normalizer.normalize(dtstart)
+        dtend_str = self.normalizer.normalize(dtend)[0]
+        year, month, day, hour, minute, second = components
+
+        # Calculate duration in hours (0 for all-day events)
+        duration = 0
+        if not is_all_day and dtstart and dtend:
+            duration = (dtend - dtstart).total_seconds() / SECONDS_PER_HOUR
+
+        # Days since 1970-01-01, for integer date ranges (see snapshot.day_number)
+        day_number = date.fromisoformat(date_str).toordinal() - EPOCH_ORDINAL
+
+        summary = fields.get("summary", "")
+        content_hash = self.event_hash(
+            summary,
+            dtstart_str,
+            dtend_str,
+            desc_fields["area"],
+            desc_fields["type"],
+            desc_fields["project"],
+        )
+        # Repeated pairs stored once, NULL when there are none
+        pairs = list(dict.fromkeys(desc_fields["facets"]))
+        facets = json.dumps(pairs) if pairs else None
+        return (
+            *self.event_key(fields),
+            desc_fields["area"],
+            desc_fields["type"],
+            desc_fields["project"],
+            summary,
+            desc_fields["text"],
+            desc_fields["search_text"],
+            dtstart_str,
+            dtend_str,
+            date_str,
+            day_number,
+            duration,
+            year,
+            month,
+            day,
+            hour,
+            minute,
+            second,
+            is_all_day,
+            facets,
+            content_hash,
+        )
 
-        # Extract calendar timezone
-        self.calendar_timezone = str(cal.get("x-wr-timezone", ""))
-        calendar_name = Path(ics_file).stem
+    def parse_calendar(self, ics_file, window=None):
+        """
+        Yield parsed rows for every VEVENT of ICS file. Recurring series are
+        collected in self.parsed_series; their occurrences inside window are
+        yielded after the last VEVENT, once every override has been seen.
+        The file's content_digest is left in self.parsed_digest.
+        """
+        calendar_name = calendar_name_of(ics_file)
+        self.calendar_timezone = None
+        self.parsed_series = []
+        self.parsed_digest = None
+        # uid -> recurrence ids replaced by an override VEVENT
+        overrides = {}
+        events = self.timed_iter("parse", self.read_events(ics_file))
+        for properties, fields in events:
+            self.set_calendar_timezone(calendar_name, properties)
+            if not fields.get("dtstart") or not fields.get("dtend"):
+                self.stats.count("invalid")
+                continue
+            if self.is_series(fields):
+                self.parsed_series.append(self.series_master(fields))
+                continue
 
-        print(f"Processing calendar: {calendar_name}")
-        print(f"Calendar timezone: {self.calendar_timezone or 'Not specified'}")
+            parsed = self.timed("normalize", self.parse_event, fields)
+            uid, recurrence_id = parsed[:2]
+            if recurrence_id:
+                overrides.setdefault(uid, set()).add(recurrence_id)
+            yield parsed
+
+        window_start, window_end = window or default_recurrence_window()
+        for master in self.parsed_series:
+            exclude = overrides.get(master["uid"], ())
+            for fields in self.expand_series(master, window_start, window_end, exclude):
+                yield self.timed("normalize", self.parse_event, fields)
+
+    def is_series(self, fields):
+        """Recurring master: has RRULE or RDATE and is not itself an override"""
+        return bool(fields.get("rrule") or fields.get("rdate")) and not fields.get(
+            "recurrence-id"
+        )
+
+    def series_master(self, fields):
+        """
+        Reduce a recurring VEVENT to a JSON-able dict. Times are kept as
+        wall-clock times in the event's own timezone, which is where the
+        RRULE is expanded so a weekly 09:00 stays 09:00 across DST changes.
+        """
+        dtstart = fields.get("dtstart")
+        dtend = fields.get("dtend") or dtstart
+
+        tzid = None
+        if isinstance(dtstart, datetime) and dtstart.tzinfo:
+            tzinfo = dtstart.tzinfo
+            tzid = getattr(tzinfo, "zone", None) or getattr(tzinfo, "key", None) or "UTC"
+
+        def local(value):
+            if isinstance(value, datetime) and value.tzinfo:
+                value = value.astimezone(pytz.timezone(tzid or "UTC"))
+                value = value.replace(tzinfo=None)
+            return value.isoformat()
+
+        return {
+            "uid": fields.get("uid"),
+            "summary": fields.get("summary", ""),
+            "description": fields.get("description", ""),
+            "last-modified": self.datetime_to_str(fields.get("last-modified")),
+            "calendar_timezone": self.calendar_timezone,
+            "tzid": tzid,
+            "dtstart": local(dtstart),
+            "duration": (dtend - dtstart).total_seconds(),
+            "rrule": fields.get("rrule"),
+            "rdate": [local(value) for value in fields.get("rdate", [])],
+            "exdate": [local(value) for value in fields.get("exdate", [])],
+        }
+
+    def local_rrule(self, rule, tz, all_day):
+        """Rewrite UNTIL to the naive local time the series is expanded in"""
+        parts = []
+        for part in rule.split(";"):
+            key, _, value = part.partition("=")
+            if key.upper() == "UNTIL":
+                if value.endswith("Z"):
+                    until = pytz.utc.localize(datetime.strptime(value, "%Y%m%dT%H%M%SZ"))
+                    if tz:
+                        until = until.astimezone(tz)
+                    value = until.strftime("%Y%m%d" if all_day else "%Y%m%dT%H%M%S")
+                elif len(value) == 8 and not all_day:
+                    # A date UNTIL includes the whole day
+                    value += "T235959"
+            parts.append(f"{key}={value}")
+        return ";".join(parts)
+
+    def expand_series(self, master, window_start, window_end, exclude=()):
+        """
+        Yield VEVENT fields for each occurrence of master between window_start
+        and window_end (dates, inclusive), honoring RDATE and EXDATE.
+        Occurrences whose RECURRENCE-ID is in exclude (overrides) are skipped.
+        """
+        tz = pytz.timezone(master["tzid"]) if master["tzid"] else None
+        all_day = "T" not in master["dtstart"]
+        start = datetime.fromisoformat(master["dtstart"])
+        duration = timedelta(seconds=master["duration"])
+
+        rules = rruleset()
+        # DTSTART is always the first instance
+        rules.rdate(start)
+        if master["rrule"]:
+            rule = self.local_rrule(master["rrule"], tz, all_day)
+            try:
+                rules.rrule(rrulestr(rule, dtstart=start))
+            except ValueError:
+                # Only DTSTART and RDATEs are materialized
+                self.stats.count("invalid")
+        for value in master["rdate"]:
+            rules.rdate(datetime.fromisoformat(value))
+        for value in master["exdate"]:
+            rules.exdate(datetime.fromisoformat(value))
+
+        lower = datetime.combine(window_start, time.min)
+        upper = datetime.combine(window_end, time.max)
+        for occurrence in rules.between(lower, upper, inc=True):
+            if all_day:
+                occurrence_start = occurrence.date()
+            else:
+                occurrence_start = tz.localize(occurrence) if tz else occurrence
+
+            recurrence_id = self.normalizer.normalize(occurrence_start)[0]
+            if recurrence_id in exclude:
+                continue
 
-        # Get or create calendar
+            yield {
+                "uid": master["uid"],
+                "summary": master["summary"],
+                "description": master["description"],
+                "last-modified": master["last-modified"],
+                "dtstart": occurrence_start,
+                "dtend": occurrence_start + duration,
+                "recurrence-id": occurrence_start,
+            }
+
+    def resolve_row(self, cursor, calendar_id, parsed):
+        """Turn a parsed row into an events row by resolving dimension ids"""
+        return (
+            calendar_id,
+            *parsed[:3],
+            *self.timed("lookup", self.dimension_ids, cursor, *parsed[3:6]),
+            *parsed[6:],
+        )
+
+    def event_values(self, cursor, calendar_id, fields):
+        """Build events table row from decoded VEVENT fields"""
+        return self.resolve_row(cursor, calendar_id, self.parse_event(fields))
+
+    def get_or_create_calendar_id(self, cursor, calendar_name, color=None):
+        """Get or create calendar ID"""
         calendar_id = self.get_or_create_lookup_id(
             cursor, "calendars", "name", calendar_name
         )
@@ -353,126 +1842,530 @@ class IcsToDb:
             cursor.execute(
                 "UPDATE calendars SET color = ? WHERE id = ?", (color, calendar_id)
             )
+        return calendar_id
+
+    def use_timezone(self, tz_name):
+        """Convert following events to tz_name"""
+        self.calendar_timezone = tz_name
+        self.normalizer = TimezoneNormalizer(tz_name)
+
+    def set_calendar_timezone(self, calendar_name, properties):
+        """Extract calendar timezone from the first event's calendar properties"""
+        if self.calendar_timezone is not None:
+            return
+        self.use_timezone(properties.get("x-wr-timezone", ""))
+        print(f"Processing calendar: {calendar_name}")
+        print(f"Calendar timezone: {self.calendar_timezone or 'Not specified'}")
 
+    def insert_rows(self, cursor, calendar_id, parsed_rows):
+        """Insert parsed rows into calendar, return number of events imported"""
         event_count = 0
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                desc_fields = self.parse_description(component.get("description", ""))
+        skipped = self.stats.counts["skipped"]
+        for parsed in parsed_rows:
+            values = self.resolve_row(cursor, calendar_id, parsed)
+            self.write_row(cursor, INSERT_EVENT_SQL, values)
+            event_count += 1
 
-                dtstart = component.get("dtstart")
-                dtend = component.get("dtend")
-                is_all_day = 0
-                if dtstart and not isinstance(dtstart.dt, datetime):
-                    is_all_day = 1
+        self.flush_rows(cursor)
+        # Rows rejected by the database, now or when a batch was written
+        return event_count - (self.stats.counts["skipped"] - skipped)
 
-                # Convert to calendar timezone if specified
-                dtstart_str = self.datetime_to_str(
-                    dtstart, self.calendar_timezone if not is_all_day else None
-                )
-                dtend_str = self.datetime_to_str(
-                    component.get("dtend"),
-                    self.calendar_timezone if not is_all_day else None,
-                )
+    def sync_rows(self, cursor, calendar_id, parsed_rows):
+        """
+        Upsert parsed rows into calendar keyed by UID and RECURRENCE-ID.
+        Unchanged events (same LAST-MODIFIED) are skipped, changed ones are
+        updated in place and events missing from parsed_rows are deleted.
+        """
+        # (uid, recurrence_id) -> (event id, last_modified)
+        cursor.execute(
+            """
+            SELECT id, uid, recurrence_id, last_modified
+            FROM events WHERE calendar_id = ?
+            """,
+            (calendar_id,),
+        )
+        existing = {}
+        stale_ids = []
+        for event_id, uid, recurrence_id, last_modified in cursor.fetchall():
+            if uid is None:
+                # Rows without UID can't be matched, rebuild them
+                stale_ids.append(event_id)
+            else:
+                existing[(uid, recurrence_id)] = (event_id, last_modified)
 
-                # Extract date in YYYY-MM-DD format
-                date_str = self.extract_date(dtstart_str)
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        for parsed in parsed_rows:
+            uid, recurrence_id, last_modified = parsed[:3]
+            current = existing.pop((uid, recurrence_id), None) if uid else None
 
-                # Calculate duration in hours (0 for all-day events)
-                duration = 0
-                if not is_all_day and dtstart and dtend:
-                    duration = (
-                        dtend.dt - dtstart.dt
-                    ).total_seconds() / SECONDS_PER_HOUR
+            if current and last_modified and current[1] == last_modified:
+                counts["unchanged"] += 1
+                continue
 
-                # Get foreign key IDs for normalized fields
-                area_id = self.get_or_create_lookup_id(
-                    cursor, "areas", "name", desc_fields["area"]
-                )
-                type_id = self.get_or_create_type_id(
-                    cursor, desc_fields["type"], desc_fields["area"]
-                )
-                project_id = self.get_or_create_project_id(
-                    cursor, desc_fields["project"], desc_fields["area"]
+            values = self.resolve_row(cursor, calendar_id, parsed)
+            if current:
+                if self.write_row(cursor, UPDATE_EVENT_SQL, (*values, current[0])):
+                    counts["updated"] += 1
+            elif self.write_row(cursor, INSERT_EVENT_SQL, values):
+                counts["inserted"] += 1
+
+        self.flush_rows(cursor)
+        stale_ids.extend(event_id for event_id, _ in existing.values())
+        cursor.executemany(
+            "DELETE FROM events WHERE id = ?", [(event_id,) for event_id in stale_ids]
+        )
+        counts["deleted"] = len(stale_ids)
+        return counts
+
+    def print_sync_counts(self, calendar_name, counts):
+        print(
+            f"Synced {calendar_name}: {counts['inserted']} inserted, "
+            f"{counts['updated']} updated, {counts['deleted']} deleted, "
+            f"{counts['unchanged']} unchanged"
+        )
+
+    def get_recurrence_window(self, cursor):
+        """Return (start, end) dates recurring events are materialized for"""
+        if self.recurrence_window:
+            return self.recurrence_window
+
+        cursor.execute(
+            """
+            SELECT key, value FROM settings
+            WHERE key IN ('recurrence_window_start', 'recurrence_window_end')
+            """
+        )
+        stored = dict(cursor.fetchall())
+        if len(stored) == 2:
+            return (
+                date.fromisoformat(stored["recurrence_window_start"]),
+                date.fromisoformat(stored["recurrence_window_end"]),
+            )
+        return default_recurrence_window()
+
+    def set_recurrence_window(self, cursor, window_start, window_end):
+        cursor.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [
+                ("recurrence_window_start", window_start.isoformat()),
+                ("recurrence_window_end", window_end.isoformat()),
+            ],
+        )
+
+    def bump_generation(self, cursor):
+        """
+        Count a change to the events and return the new generation. Readers
+        compare it to their snapshot and to the generation they last loaded.
+        """
+        cursor.execute(
+            """
+            INSERT INTO settings (key, value) VALUES ('generation', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1
+            """
+        )
+        self.generation = read_generation(self.conn)
+        return self.generation
+
+    def store_series(self, cursor, calendar_id, series):
+        """Replace the recurring series masters stored for calendar"""
+        cursor.execute("DELETE FROM recurrences WHERE calendar_id = ?", (calendar_id,))
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO recurrences (calendar_id, uid, master)
+            VALUES (?, ?, ?)
+            """,
+            [(calendar_id, master["uid"], json.dumps(master)) for master in series],
+        )
+
+    def write_calendar(
+        self,
+        cursor,
+        calendar_name,
+        parsed_rows,
+        color=None,
+        series=None,
+        incremental=False,
+        digest=None,
+    ):
+        """
+        Write parsed rows and recurring series of one calendar. series and
+        the file's digest default to self.parsed_series and
+        self.parsed_digest, filled once parsed_rows is consumed.
+        Returns the number of events written.
+        """
+        calendar_id = self.get_or_create_calendar_id(cursor, calendar_name, color)
+        if self.dedupe != "keep":
+            parsed_rows = self.deduplicated(cursor, calendar_id, parsed_rows)
+        if incremental:
+            counts = self.sync_rows(cursor, calendar_id, parsed_rows)
+            self.print_sync_counts(calendar_name, counts)
+            event_count = counts["inserted"] + counts["updated"]
+        else:
+            event_count = self.insert_rows(cursor, calendar_id, parsed_rows)
+            print(f"Imported {event_count} events from {calendar_name}")
+        self.timed("segments", self.sync_segments, cursor, calendar_id)
+        self.timed("facets", self.sync_facets, cursor, calendar_id)
+        self.timed("rollups", self.sync_rollups, cursor)
+        self.timed("search", self.sync_search_index, cursor)
+
+        self.store_series(
+            cursor, calendar_id, self.parsed_series if series is None else series
+        )
+        if calendar_name in self.fingerprints:
+            source, size, mtime, known_digest = self.fingerprints[calendar_name]
+            if digest is None:
+                digest = self.parsed_digest
+            self.store_manifest(
+                cursor, calendar_id, (source, size, mtime, known_digest or digest)
+            )
+        return event_count
+
+    def deduplicated(self, cursor, calendar_id, parsed_rows):
+        """
+        Yield the parsed rows of calendar whose content hash is not taken
+        under self.dedupe: first copy in the file wins, and with "all" a
+        hash stored in another calendar is taken too. In incremental mode a
+        stored event whose row is dropped here is deleted by sync_rows.
+        """
+        taken = set()
+        if self.dedupe == "all":
+            cursor.execute(
+                """
+                SELECT DISTINCT content_hash FROM events
+                WHERE content_hash IS NOT NULL AND calendar_id != ?
+                """,
+                (calendar_id,),
+            )
+            taken = {row[0] for row in cursor.fetchall()}
+
+        for parsed in parsed_rows:
+            content_hash = parsed[-1]
+            if content_hash in taken:
+                self.stats.count("duplicates")
+                continue
+            taken.add(content_hash)
+            yield parsed
+
+    def changed_files(self, cursor, ics_files, incremental=False):
+        """
+        Fingerprint ics_files and return the ones that need parsing. With
+        incremental set, files whose size and mtime, or else content digest,
+        match the manifest are skipped: their events are already stored.
+        So are files older than the one a calendar was last imported from.
+        The digest is only read here when size or mtime changed; for other
+        files parsing computes it (see write_calendar).
+        """
+        changed = []
+        for ics_file in ics_files:
+            calendar_name = calendar_name_of(ics_file)
+            size, mtime = source_stat(ics_file)
+            stored = None
+            if incremental:
+                cursor.execute(
+                    """
+                    SELECT m.calendar_id, m.size, m.mtime, m.digest
+                    FROM manifest m JOIN calendars c ON c.id = m.calendar_id
+                    WHERE c.name = ?
+                    """,
+                    (calendar_name,),
                 )
+                stored = cursor.fetchone()
 
-                # Extract datetime components from dtstart
-                year, month, day, hour, minute, second = (
-                    self.extract_datetime_components(dtstart_str)
+            if stored and stored[1:3] == (size, mtime):
+                print(f"Skipping unchanged {calendar_name}")
+                self.stats.emit("calendar_skipped", calendar=calendar_name)
+                continue
+            if stored and mtime < stored[2]:
+                # An older export (e.g. a stale file in ics/ after a zip
+                # import) would delete the events added since
+                print(f"Skipping {calendar_name}, older than its last import")
+                self.stats.emit("calendar_skipped", calendar=calendar_name)
+                continue
+
+            digest = None
+            if stored:
+                digest = content_digest(ics_file)
+            if digest and stored[3] == digest:
+                # Re-exported without changes
+                cursor.execute(
+                    "UPDATE manifest SET size = ?, mtime = ? WHERE calendar_id = ?",
+                    (size, mtime, stored[0]),
                 )
+                print(f"Skipping unchanged {calendar_name}")
+                self.stats.emit("calendar_skipped", calendar=calendar_name)
+                continue
 
-                try:
-                    cursor.execute(
-                        """
-                        INSERT INTO events (
-                            calendar_id, summary, dtstart, dtend, date, duration,
-                            year, month, day, hour, minute, second,
-                            area_id, project_id, type_id, is_all_day
-                        ) VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (
-                            calendar_id,
-                            str(component.get("summary", "")),
-                            dtstart_str,
-                            dtend_str,
-                            date_str,
-                            duration,
-                            year,
-                            month,
-                            day,
-                            hour,
-                            minute,
-                            second,
-                            area_id,
-                            project_id,
-                            type_id,
-                            is_all_day,
-                        ),
-                    )
+            self.fingerprints[calendar_name] = (str(ics_file), size, mtime, digest)
+            changed.append(ics_file)
+        return changed
+
+    def store_manifest(self, cursor, calendar_id, fingerprint):
+        """Record the file calendar was imported from and its event count"""
+        cursor.execute(
+            "SELECT COUNT(*) FROM events WHERE calendar_id = ?", (calendar_id,)
+        )
+        event_count = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO manifest
+                (calendar_id, source, size, mtime, digest, event_count, generation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (calendar_id, *fingerprint, event_count, self.generation),
+        )
+
+    def import_calendar(self, ics_file, color=None):
+        """Import ICS file to SQLite database with normalized schema"""
+        colors = {calendar_name_of(ics_file): color}
+        return self.import_calendars([ics_file], colors, workers=1)
 
-                    event_count += 1
-                except sqlite3.IntegrityError as e:
-                    print(f"Skipping event: {e}")
+    def sync_calendar(self, ics_file, color=None):
+        """Upsert ICS file into the database, touching only changed events"""
+        colors = {calendar_name_of(ics_file): color}
+        return self.import_calendars([ics_file], colors, incremental=True, workers=1)
+
+    def import_calendars(
+        self, ics_files, colors=None, incremental=False, workers=None, keep=None
+    ):
+        """
+        Import many ICS files (paths or ZipMembers): a process pool parses
+        the files into plain rows and this process writes them all in a
+        single transaction as each file finishes. With incremental set, rows
+        are upserted by UID, events that left a file are deleted and files
+        unchanged since they were last imported are not parsed at all.
+        Calendars not named in keep, if given, are deleted first, in the
+        same transaction. Returns the number of events written.
+        """
+        colors = colors or {}
+
+        self.init_db()
+        cursor = self.conn.cursor()
+        if keep is not None:
+            removed = self.delete_calendars_except(cursor, keep)
+            if removed:
+                print(f"Removed {removed} calendars with no ICS file")
+        ics_files = self.changed_files(cursor, ics_files, incremental)
+        workers = min(workers or os.cpu_count() or 1, len(ics_files))
+        window = self.get_recurrence_window(cursor)
+        self.set_recurrence_window(cursor, *window)
+        if ics_files:
+            self.bump_generation(cursor)
+
+        self.stats.emit("import_started", total=len(ics_files))
+        total_events = 0
+        calendars = self.parsed_calendars(ics_files, window, workers)
+        for done, (calendar_name, parsed_rows, series, digest) in enumerate(
+            calendars, 1
+        ):
+            event_count = self.write_calendar(
+                cursor,
+                calendar_name,
+                parsed_rows,
+                colors.get(calendar_name),
+                series,
+                incremental,
+                digest,
+            )
+            total_events += event_count
+            self.stats.emit(
+                "calendar_written",
+                calendar=calendar_name,
+                done=done,
+                total=len(ics_files),
+                events=event_count,
+            )
+
+        if ics_files and not incremental:
+            # Planner statistics, so dashboard queries pick the covering
+            # indexes; analysis_limit samples instead of reading every row.
+            # A sync changes too little of the database to update them.
+            cursor.execute("PRAGMA analysis_limit = 1000")
+            self.timed("analyze", cursor.execute, "ANALYZE")
 
         self.conn.commit()
         self.conn.close()
+        self.stats.count("events", total_events)
+        self.stats.emit("import_finished", **self.stats.summary())
+        return total_events
 
-        print(f"Imported {event_count} events to {self.db_file}")
-        return event_count
+    def parsed_calendars(self, ics_files, window, workers):
+        """
+        Yield (calendar name, parsed rows, series, digest) per ICS file. In
+        this process rows are parsed lazily and series and digest are None
+        (see write_calendar), in a pool they come back with the rows.
+        """
+        if workers <= 1:
+            for ics_file in ics_files:
+                parsed_rows = self.parse_calendar(ics_file, window)
+                yield calendar_name_of(ics_file), parsed_rows, None, None
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(parse_calendar_file, ics_file, window)
+                for ics_file in ics_files
+            ]
+            for future in as_completed(futures):
+                calendar_name, parsed_rows, series, digest, stats = future.result()
+                self.stats.merge(stats)
+                yield calendar_name, parsed_rows, series, digest
+
+    def extend_recurrence_window(self, start_date, end_date, blocking=True):
+        """
+        Materialize recurring events for the part of start_date..end_date
+        outside the current window and widen the window. Occurrences that
+        already exist, overrides included, are left alone.
+        Returns True if the window grew. With blocking False, raises
+        BlockingIOError instead of waiting for an import to finish.
+        """
+        with write_lock(self.db_file, blocking):
+            return self.extend_window(start_date, end_date)
+
+    def extend_window(self, start_date, end_date):
+        """extend_recurrence_window, with the write lock held"""
+        self.init_db()
+        cursor = self.conn.cursor()
+
+        window_start, window_end = self.get_recurrence_window(cursor)
+        ranges = []
+        if start_date < window_start:
+            ranges.append((start_date, window_start - timedelta(days=1)))
+        if end_date > window_end:
+            ranges.append((window_end + timedelta(days=1), end_date))
+        if not ranges:
+            self.conn.close()
+            return False
+
+        cursor.execute("SELECT calendar_id, master FROM recurrences")
+        for calendar_id, master_json in cursor.fetchall():
+            master = json.loads(master_json)
+            self.use_timezone(master["calendar_timezone"])
+            for range_start, range_end in ranges:
+                for fields in self.expand_series(master, range_start, range_end):
+                    values = self.event_values(cursor, calendar_id, fields)
+                    self.write_row(cursor, INSERT_OR_IGNORE_EVENT_SQL, values)
+
+        self.flush_rows(cursor)
+        self.sync_segments(cursor)
+        self.sync_facets(cursor)
+        self.sync_rollups(cursor)
+        self.sync_search_index(cursor)
+        self.set_recurrence_window(
+            cursor, min(start_date, window_start), max(end_date, window_end)
+        )
+        self.bump_generation(cursor)
+        self.conn.commit()
+        self.conn.close()
+        write_snapshot(self.db_file)
+
+        print(f"Recurrence window extended to {start_date} - {end_date}")
+        return True
+
+    def remove_calendars_except(self, calendar_names):
+        """Delete calendars (and their events) not in calendar_names"""
+        self.init_db()
+        removed = self.delete_calendars_except(self.conn.cursor(), calendar_names)
+        self.conn.commit()
+        self.conn.close()
+        return removed
+
+    def delete_calendars_except(self, cursor, calendar_names):
+        """remove_calendars_except, in the caller's transaction"""
+        names = [name.strip().lower() for name in calendar_names]
+        placeholders = ", ".join("?" for _ in names)
+        cursor.execute(
+            f"DELETE FROM calendars WHERE name NOT IN ({placeholders})", names
+        )
+        removed = cursor.rowcount
+        if removed:
+            self.sync_rollups(cursor)
+            self.bump_generation(cursor)
+        return removed
+
+
+def source_stat(ics_file):
+    """(size, mtime in ns) of an ICS path or ZipMember"""
+    if isinstance(ics_file, ZipMember):
+        with zipfile.ZipFile(ics_file.zip_path) as zip_file:
+            info = zip_file.getinfo(ics_file.name)
+        mtime = datetime(*info.date_time).timestamp()
+        return info.file_size, int(mtime * 1_000_000_000)
+
+    stat = os.stat(ics_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def content_digest(ics_file):
+    """
+    BLAKE2 digest of an ICS path, ZipMember or binary file object, ignoring
+    export timestamps
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    def update(source):
+        for _ in IcsStreamReader(source, digest).physical_lines():
+            pass
+
+    if isinstance(ics_file, ZipMember):
+        with zipfile.ZipFile(ics_file.zip_path) as zip_file:
+            with zip_file.open(ics_file.name) as member:
+                update(member)
+    else:
+        update(ics_file)
+    return digest.hexdigest()
+
+
+def default_recurrence_window():
+    """RECURRENCE_WINDOW_DAYS either side of today"""
+    today = date.today()
+    days = timedelta(days=RECURRENCE_WINDOW_DAYS)
+    return today - days, today + days
+
+
+def parse_calendar_file(ics_file, window=None):
+    """
+    Process pool worker: parse ICS file into
+    (name, parsed rows, series, digest, stats)
+    """
+    parser = IcsToDb(streaming=True)
+    parsed_rows = list(parser.parse_calendar(ics_file, window))
+    return (
+        calendar_name_of(ics_file),
+        parsed_rows,
+        parser.parsed_series,
+        parser.parsed_digest,
+        parser.stats,
+    )
 
 
 class DbToIcs:
     """Convert SQLite database to ICS file with normalized schema"""
 
-    def __init__(self, db_file="calendar.db"):
+    def __init__(self, db_file="calendar.db", stats=None):
         self.db_file = db_file
         self.conn = None
+        self.stats = stats or PipelineStats()
 
-    def get_lookup_value(self, cursor, table_name, id_value):
-        """Get name from lookup table by ID"""
-        if not id_value:
-            return None
-
-        cursor.execute(f"SELECT name FROM {table_name} WHERE id = ?", (id_value,))
-        row = cursor.fetchone()
-        return row[0] if row else None
-
-    def format_description(self, event_row, cursor):
-        """Format event fields back to description from normalized tables"""
+    def format_description(self, event_row):
+        """Format event fields back to description from the joined lookup names"""
         parts = []
 
-        # Get values from lookup tables
-        area_name = self.get_lookup_value(cursor, "areas", event_row["area_id"])
-        type_name = self.get_lookup_value(cursor, "types", event_row["type_id"])
-        project_name = self.get_lookup_value(
-            cursor, "projects", event_row["project_id"]
-        )
-
-        if area_name:
-            parts.append(f"Area: {area_name}")
-        if type_name:
-            parts.append(f"Type: {type_name}")
-        if project_name:
-            parts.append(f"Project: {project_name}")
+        if event_row["area_name"]:
+            parts.append(f"Area: {event_row['area_name']}")
+        if event_row["type_name"]:
+            parts.append(f"Type: {event_row['type_name']}")
+        if event_row["project_name"]:
+            parts.append(f"Project: {event_row['project_name']}")
+
+        # key -> values, list keys written back on one line
+        facets = {}
+        for key, value in json.loads(event_row["facets"] or "[]"):
+            facets.setdefault(key, []).append(value)
+        for key, values in facets.items():
+            if key in FACET_LIST_KEYS:
+                parts.append(f"{key.title()}: {', '.join(values)}")
+            else:
+                parts.extend(f"{key.title()}: {value}" for value in values)
 
         return "\n".join(parts)
 
@@ -498,71 +2391,163 @@ class DbToIcs:
             return None
 
     def export_calendar(self, ics_file, calendar_name=None):
-        """Export SQLite database to ICS file"""
-        self.conn = sqlite3.connect(self.db_file)
+        """
+        Export SQLite database to ICS file.
+
+        Lookup names are joined in the events query and every VEVENT is written
+        as the cursor is iterated, so memory use does not grow with the number
+        of events. The database is opened read-only.
+        """
+        self.conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
         self.conn.row_factory = sqlite3.Row
         cursor = self.conn.cursor()
 
-        cal = Calendar()
-        cal.add("prodid", "-//Calendar Sync//mxm.dk//")
-        cal.add("version", "2.0")
-
-        # Build events query based on calendar filter
-        if calendar_name:
-            cursor.execute("SELECT id FROM calendars WHERE name = ?", (calendar_name,))
-            calendar_row = cursor.fetchone()
-            if calendar_row:
-                calendar_id = calendar_row["id"]
+        try:
+            # Build events query based on calendar filter
+            if calendar_name:
                 cursor.execute(
-                    """
-                    SELECT e.* FROM events e 
-                    WHERE e.calendar_id = ?
-                    ORDER BY e.dtstart
-                """,
-                    (calendar_id,),
+                    "SELECT id FROM calendars WHERE name = ?", (calendar_name,)
+                )
+                calendar_row = cursor.fetchone()
+                if not calendar_row:
+                    print(f"Calendar '{calendar_name}' not found")
+                    return 0
+                cursor.execute(
+                    EXPORT_EVENTS_SQL.format(where="WHERE e.calendar_id = ?"),
+                    (calendar_row["id"],),
                 )
             else:
-                print(f"Calendar '{calendar_name}' not found")
-                return 0
-        else:
-            # Export all events from all calendars
-            cursor.execute("SELECT * FROM events ORDER BY dtstart")
-
-        events = cursor.fetchall()
+                # Export all events from all calendars
+                cursor.execute(EXPORT_EVENTS_SQL.format(where=""))
 
-        for event_row in events:
-            event = Event()
+            # Written next to ics_file and renamed into place, so a reader
+            # never sees a half written export
+            tmp_file = Path(f"{ics_file}.tmp")
+            try:
+                start = perf_counter()
+                with open(tmp_file, "wb") as f:
+                    count = self.write_events(f, cursor)
+                os.replace(tmp_file, ics_file)
+                self.stats.add_time("export", perf_counter() - start)
+            except Exception:
+                tmp_file.unlink(missing_ok=True)
+                raise
+        finally:
+            self.conn.close()
+
+        print(f"Exported {count} events to {ics_file}")
+        return count
+
+    def write_events(self, f, rows):
+        """Write a VCALENDAR with one VEVENT per row to f, return the count"""
+        cal = Calendar()
+        cal.add("prodid", "-//Calendar Sync//mxm.dk//")
+        cal.add("version", "2.0")
+        footer = b"END:VCALENDAR\r\n"
+        f.write(cal.to_ical()[: -len(footer)])
 
+        dtstamp = datetime.now()
+        count = 0
+        for event_row in rows:
             # Convert string dates to proper objects
             dtstart = self.str_to_datetime(event_row["dtstart"])
             dtend = self.str_to_datetime(event_row["dtend"])
-            print(dtstart, dtend)
 
             if not dtstart or not dtend:
-                print(f"Skipping event {event_row['id']} due to invalid dates")
+                self.stats.count("invalid")
                 continue
 
             # Add basic event properties
+            event = Event()
             event.add("uid", f"event-{event_row['id']}")
             event.add("dtstart", dtstart)
             event.add("dtend", dtend)
             event.add("summary", event_row["summary"])
-            event.add("dtstamp", datetime.now())
+            event.add("dtstamp", dtstamp)
 
             # Build description from normalized fields
-            description = self.format_description(event_row, cursor)
+            description = self.format_description(event_row)
             if description:
                 event.add("description", description)
 
-            cal.add_component(event)
+            f.write(event.to_ical())
+            count += 1
 
-        # Write to file
-        with open(ics_file, "wb") as f:
-            f.write(cal.to_ical())
+        f.write(footer)
+        return count
 
-        self.conn.close()
-        print(f"Exported {len(events)} events to {ics_file}")
-        return len(events)
+
+def export_calendar_file(db_file, ics_file, calendar_name):
+    """Export one calendar of db_file to ics_file, return (name, event count, stats)"""
+    exporter = DbToIcs(db_file)
+    count = exporter.export_calendar(ics_file, calendar_name)
+    return calendar_name, count, exporter.stats
+
+
+def export_calendars(db_file, output_dir, workers=None, stats=None):
+    """
+    Export every calendar in db_file to output_dir/<calendar name>.ics.
+
+    Calendars are exported by up to `workers` processes (default: one per
+    CPU), largest first, each with its own read-only connection. Progress
+    is reported to stats (a PipelineStats). Returns the number of events
+    exported per calendar.
+    """
+    stats = stats or PipelineStats()
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        calendar_names = [
+            row[0]
+            for row in conn.execute(
+                """
+                SELECT c.name FROM calendars c
+                LEFT JOIN events e ON e.calendar_id = c.id
+                GROUP BY c.id
+                ORDER BY COUNT(e.id) DESC
+                """
+            )
+        ]
+    finally:
+        conn.close()
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(db_file, output_dir / f"{name}.ics", name) for name in calendar_names]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    def exported(results):
+        for done, (calendar_name, count, calendar_stats) in enumerate(results, 1):
+            stats.merge(calendar_stats)
+            stats.count("events", count)
+            counts[calendar_name] = count
+            stats.emit(
+                "calendar_exported",
+                calendar=calendar_name,
+                done=done,
+                total=len(jobs),
+                events=count,
+            )
+
+    stats.emit("export_started", total=len(jobs))
+    counts = {}
+    if workers <= 1:
+        exported(export_calendar_file(*job) for job in jobs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(export_calendar_file, *job) for job in jobs]
+            exported(future.result() for future in as_completed(futures))
+    stats.emit("export_finished", **stats.summary())
+    return counts
+
+
+def print_skipped(stats):
+    """One line for the events a run left out, instead of one per event"""
+    counts = stats.counts
+    if counts["skipped"] or counts["invalid"] or counts["duplicates"]:
+        print(
+            f"Left out {counts['skipped']} rejected, {counts['invalid']} invalid "
+            f"and {counts['duplicates']} duplicate events"
+        )
 
 
 def setup_dirs():
@@ -573,60 +2558,341 @@ def setup_dirs():
     print(f"DB Directory: {DB_DIR}")
 
 
-def merge_to_one_db(output_db_file="data.db"):
+class StaleShadowError(Exception):
+    """The live database changed after the shadow of an import read it"""
+
+
+def install_database(shadow_path, db_path, generation=0):
     """
-    Imports all ICS files from the ICS_DIR into a single SQLite database file.
-    It deletes the existing output_db_file first to ensure a fresh start.
+    Copy a validated shadow database into db_path in one write transaction.
+
+    Renaming it over a WAL database would leave the old file's -wal and
+    -shm next to the new one, for the next connection to read as its own.
+    Copied in place, readers keep their snapshot until the copy commits
+    and read the new data from then on, through the same connections.
+
+    generation is the one db_path had when the shadow was based on it. If
+    another writer changed db_path since, the copy is rolled back and
+    StaleShadowError raised: installing it would undo that change.
+    """
+    if not db_path.exists():
+        # Left by a deleted database, they would be read as the new one's
+        for suffix in ("-wal", "-shm"):
+            Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+        os.replace(shadow_path, db_path)
+        # Syncs write in place, while readers read
+        conn = connect(db_path)
+        enable_wal(conn)
+        conn.close()
+        return
+    source = sqlite3.connect(f"file:{shadow_path}?mode=ro", uri=True)
+    target = connect(db_path)
+    live = connect(db_path, readonly=True)
+
+    def check_generation(status, remaining, total):
+        # Called after each step. The first one takes the write lock of
+        # db_path and it is held until the copy commits, so no writer gets
+        # in between this check and the install.
+        if remaining and read_generation(live) != generation:
+            raise StaleShadowError(f"{db_path.name} changed during the import")
+
+    # Fewer pages than the shadow has: the check runs before the commit
+    page_count = source.execute("PRAGMA page_count").fetchone()[0]
+    pages = max(1, min(INSTALL_STEP_PAGES, page_count - 1))
+    try:
+        enable_wal(target)
+        source.backup(target, pages=pages, progress=check_generation)
+        # Return the WAL's disk space: the copy passed through it
+        target.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        live.close()
+        target.close()
+        source.close()
+    shadow_path.unlink()
+
+
+def validate_database(db_path):
+    """Raise sqlite3.DatabaseError if db_path is not fit to replace the live db"""
+    conn = sqlite3.connect(db_path)
+    try:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if integrity != "ok":
+            raise sqlite3.DatabaseError(f"Integrity check failed: {integrity}")
+        if conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.DatabaseError("Foreign key check failed")
+        # Each calendar holds the events its import counted
+        mismatch = conn.execute(
+            """
+            SELECT m.calendar_id FROM manifest m
+            WHERE m.event_count != (
+                SELECT COUNT(*) FROM events e WHERE e.calendar_id = m.calendar_id
+            )
+            """
+        ).fetchone()
+        if mismatch:
+            raise sqlite3.DatabaseError(
+                f"Event count of calendar {mismatch[0]} does not match the import"
+            )
+    finally:
+        conn.close()
+
+
+def import_sources(
+    ics_files,
+    output_db_file="data.db",
+    incremental=False,
+    workers=None,
+    stats=None,
+    prune=True,
+    dedupe="keep",
+):
+    """
+    Import ICS files (paths or ZipMembers) into a single SQLite database file.
+
+    Either way readers keep seeing the old data until the import commits
+    and a failed import leaves it untouched. With incremental set, the
+    import is written into output_db_file in one transaction: events are
+    upserted by UID so only what changed is written, and calendars not in
+    ics_files are removed unless prune is False. Otherwise (or when there
+    is no database yet) it is built in a shadow database next to
+    output_db_file, which is validated and copied into place in one
+    transaction (see install_database).
+    Files are parsed in parallel by up to `workers` processes (default: one
+    per CPU) and written in a single transaction. Progress is reported to
+    stats (a PipelineStats). dedupe is one of DEDUPE_POLICIES; in
+    incremental mode it applies to the calendars whose file changed.
     """
     setup_dirs()
+    stats = stats or PipelineStats()
 
     output_db_path = DB_DIR / output_db_file
+    with write_lock(output_db_path):
+        return import_locked(
+            ics_files, output_db_path, incremental, workers, stats, prune, dedupe
+        )
 
-    if output_db_path.exists():
-        output_db_path.unlink()
-        print(f"Removed existing database: {output_db_file}")
-
-    colors = {
-        "work": "#489160",
-        "saeed": "#7C7C7C",
-        "study": "#4B99D2",
-        "growth": "#A479B1",
-    }
-
-    importer = IcsToDb(output_db_path)
-    importer.init_db()
 
-    total_events_imported = 0
-    for ics_file_path in ICS_DIR.glob("*.ics"):
-        color = colors.get(ics_file_path.stem)
-        print(f"\nImporting {ics_file_path.name} into {output_db_file}...")
+def import_locked(ics_files, output_db_path, incremental, workers, stats, prune, dedupe):
+    """import_sources, with the write lock of output_db_path held"""
+    output_db_file = output_db_path.name
+    ics_files = list(ics_files)
+    print(f"\nImporting {len(ics_files)} ICS files into {output_db_file}...")
+    try:
+        if incremental and output_db_path.exists():
+            total_events_imported, changed = sync_database(
+                ics_files, output_db_path, workers, stats, prune, dedupe
+            )
+        else:
+            total_events_imported = rebuild_database(
+                ics_files, output_db_path, workers, stats, dedupe
+            )
+            changed = True
+    except Exception as e:
+        print(f"Import failed, {output_db_file} left unchanged.")
+        stats.emit("import_failed", error=str(e))
+        raise
 
-        total_events_imported += importer.import_calendar(ics_file_path, color)
+    if changed:
+        # Columnar copy of the events for the app's startup
+        write_snapshot(output_db_path)
 
     print(f"\nAll ICS files imported successfully.")
     print(f"Total events imported: **{total_events_imported}**")
+    print_skipped(stats)
     print(f"Database created at: **{output_db_path}**")
+    return total_events_imported
+
+
+def sync_database(ics_files, db_path, workers, stats, prune, dedupe):
+    """
+    Import ics_files incrementally into the live db_path, in one
+    transaction: WAL readers see the old data until it commits and a
+    failure rolls it back. The work is proportional to what changed, so
+    there is no copy, integrity check or ANALYZE of the whole database.
+    Returns (events written, whether the data changed).
+    """
+    importer = IcsToDb(
+        db_path, streaming=True, batch_size=BATCH_SIZE, stats=stats, dedupe=dedupe
+    )
+    keep = [calendar_name_of(ics_file) for ics_file in ics_files] if prune else None
+    try:
+        total_events = importer.import_calendars(
+            ics_files, CALENDAR_COLORS, incremental=True, workers=workers, keep=keep
+        )
+    except Exception:
+        if importer.conn:
+            # Closing without a commit rolls the import back
+            importer.conn.close()
+        raise
+    # bump_generation sets it, only when something was written
+    return total_events, bool(importer.generation)
+
+
+def rebuild_database(ics_files, db_path, workers, stats, dedupe):
+    """
+    Import ics_files into a new shadow database, validate it and install
+    it as db_path. A shadow that another writer made stale before it was
+    installed is imported again, up to INSTALL_ATTEMPTS times.
+    Returns the number of events written.
+    """
+    # Shadows left by imports that crashed: a running one would hold the lock
+    for leftover in db_path.parent.glob(f"{db_path.name}.*.tmp*"):
+        leftover.unlink()
+
+    for attempt in range(1, INSTALL_ATTEMPTS + 1):
+        fd, shadow_name = tempfile.mkstemp(
+            prefix=f"{db_path.name}.", suffix=".tmp", dir=db_path.parent
+        )
+        os.close(fd)
+        shadow_db_path = Path(shadow_name)
+
+        generation = 0
+        if db_path.exists():
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            generation = read_generation(conn)
+            conn.close()
+
+        try:
+            importer = IcsToDb(
+                shadow_db_path,
+                streaming=True,
+                batch_size=BATCH_SIZE,
+                stats=stats,
+                dedupe=dedupe,
+            )
+            importer.init_db()
+            if generation:
+                # A rebuild counts on from the live database, so readers see a change
+                importer.conn.execute(
+                    "INSERT INTO settings (key, value) VALUES ('generation', ?)",
+                    (generation,),
+                )
+                importer.conn.commit()
+
+            total_events = importer.import_calendars(
+                ics_files, CALENDAR_COLORS, workers=workers
+            )
+            validate_database(shadow_db_path)
+            install_database(shadow_db_path, db_path, generation)
+            return total_events
+        except StaleShadowError:
+            if attempt == INSTALL_ATTEMPTS:
+                raise
+            print(f"{db_path.name} changed during the import, importing again")
+        finally:
+            shadow_db_path.unlink(missing_ok=True)
+
+
+def merge_to_one_db(
+    output_db_file="data.db", incremental=True, workers=None, stats=None, dedupe="keep"
+):
+    """
+    Imports all ICS files from the ICS_DIR into a single SQLite database file.
+    Incremental by default, so only files that changed since the last run
+    are parsed.
+    """
+    return import_sources(
+        ICS_DIR.glob("*.ics"),
+        output_db_file,
+        incremental=incremental,
+        workers=workers,
+        stats=stats,
+        dedupe=dedupe,
+    )
+
+
+def zip_members(zip_path):
+    """
+    List the calendars of a Google Calendar export zip as ZipMembers.
+    `Work_abc@group.calendar.google.com.ics` becomes calendar `work` and the
+    Birthday calendar is left out.
+    """
+    members = []
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for name in zip_file.namelist():
+            if not name.lower().endswith(".ics"):
+                continue
+            if "Birthday" in name:
+                print("Birthday calendar skipped.")
+                continue
+            calendar_name = Path(name).name.split("_")[0].lower()
+            members.append(ZipMember(str(zip_path), name, calendar_name))
+    return members
+
+
+def import_zip(
+    zip_path,
+    output_db_file="data.db",
+    incremental=True,
+    workers=None,
+    stats=None,
+    dedupe="calendar",
+):
+    """
+    Import a Google Calendar export zip straight from the archive. Its
+    calendars then replace the ICS files in ICS_DIR (see write_members),
+    so merge_to_one_db and sync.py go on from what was imported. Copies of
+    an event within a calendar, left by re-exports, are dropped by default.
+    """
+    members = zip_members(zip_path)
+    total_events = import_sources(
+        members,
+        output_db_file,
+        incremental=incremental,
+        workers=workers,
+        stats=stats,
+        dedupe=dedupe,
+    )
+    write_members(members, ICS_DIR, prune=True)
+    return total_events
+
+
+def write_members(members, folder, prune=False):
+    """
+    Write ZipMembers into folder as <calendar>.ics with the member's mtime:
+    size and mtime match the manifest, so an incremental import skips them
+    unparsed. A file newer than its member is kept. With prune, ICS files
+    of calendars not in members are removed.
+    """
+    folder.mkdir(exist_ok=True)
+    names = set()
+    for member in members:
+        ics_file = folder / f"{member.calendar_name}.ics"
+        names.add(ics_file.name)
+        mtime = source_stat(member)[1]
+        if ics_file.exists() and ics_file.stat().st_mtime_ns >= mtime:
+            continue
+        # Renamed into place: sync.py never reads half a file
+        tmp_file = ics_file.with_name(ics_file.name + ".tmp")
+        with zipfile.ZipFile(member.zip_path) as zip_file:
+            with zip_file.open(member.name) as source, open(tmp_file, "wb") as f:
+                shutil.copyfileobj(source, f)
+        os.utime(tmp_file, ns=(mtime, mtime))
+        os.replace(tmp_file, ics_file)
+        print(f"File {ics_file} written.")
+
+    if prune:
+        for ics_file in folder.glob("*.ics"):
+            if ics_file.name not in names:
+                ics_file.unlink()
+                print(f"File {ics_file} removed.")
 
 
 def to_db():
-    colors = {
-        "work": "#489160",
-        "saeed": "#7C7C7C",
-        "study": "#4B99D2",
-        "growth": "#A479B1",
-    }
     for ics_file_path in ICS_DIR.glob("*.ics"):
         db_file_name = ics_file_path.stem + ".db"
-        color = colors.get(ics_file_path.stem)
+        color = CALENDAR_COLORS.get(ics_file_path.stem)
         importer = IcsToDb(Path(DB_DIR / db_file_name))
         importer.import_calendar(ics_file_path, color)
 
 
-def to_ics():
-    for db_file_path in DB_DIR.glob("*.db"):
-        ics_file_name = db_file_path.stem + ".ics"
-        exporter = DbToIcs(Path(db_file_path))
-        exporter.export_calendar(ICS_DIR / ics_file_name)
+def to_ics(db_file="data.db", output_dir=EXPORT_DIR, workers=None, stats=None):
+    """Export each calendar in db_file to its own ICS file in output_dir"""
+    stats = stats or PipelineStats()
+    counts = export_calendars(DB_DIR / db_file, output_dir, workers, stats)
+    print(f"Exported {sum(counts.values())} events from {len(counts)} calendars")
+    print_skipped(stats)
+    return counts
 
 
 if __name__ == "__main__":
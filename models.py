@@ -1,40 +1,199 @@
 # models.py
+from collections import OrderedDict, namedtuple
 from dataclasses import dataclass
+import functools
+import inspect
+import re
 import sqlite3
+import threading
 from pathlib import Path
 
 from datetime import date
 
+import numpy as np
+
+from connections import ConnectionPool
+from snapshot import EventSnapshot, day_number, day_string, read_generation, sql_round
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "db"
 DB_FILE = DB_PATH / "data.db"
+# CalendarModel results kept by QueryCache
+CACHE_SIZE = 256
+# FilterView filter value -> daily_rollups kind
+FILTER_KINDS = {"Areas": "area", "Types": "type", "Projects": "project"}
+# Rows per chart in the dashboard (and values in its item list)
+DASHBOARD_LIMIT = 5
+# Dtypes of DashboardSnapshot.daily_columns
+DAILY_DTYPES = {"date": "datetime64[D]", "total_duration": "f8", "event_count": "i8"}
 
 
 class Record:
-    """Proxy object that makes dict keys accessible as attributes."""
+    """Base of the row types: a tuple whose columns are also attributes."""
+
+    __slots__ = ()
 
-    def __init__(self, data: dict):
-        self._data = data
+    def to_dict(self):
+        return self._asdict()
 
-    def __getattr__(self, name):
-        if name in self._data:
-            return self._data[name]
-        raise AttributeError(f"No attribute '{name}'")
 
-    def __repr__(self):
-        return f"Record({self._data})"
+@functools.cache
+def row_type(columns: tuple[str, ...]) -> type:
+    """Slotted namedtuple Record type for a result's column names.
 
-    def to_dict(self):
-        return self._data.copy()
+    Made once per column list, so every query gets its own row type and
+    queries selecting the same columns share it.
+    """
+    return type("Record", (namedtuple("Record", columns), Record), {"__slots__": ()})
+
+
+def record(data: dict) -> Record:
+    """Row of data's keys and values, for results built in Python"""
+    return row_type(tuple(data))._make(data.values())
+
+
+def column_names(cursor) -> tuple[str, ...]:
+    return tuple(column[0] for column in cursor.description)
+
+
+def to_columns(rows, names, dtypes) -> dict[str, np.ndarray]:
+    """{name: read-only array} of rows' columns.
+
+    dtypes maps names to NumPy dtypes, other columns are object arrays.
+    NULL reads as NaN in float columns.
+    """
+    dtype = np.dtype([(name, dtypes.get(name, object)) for name in names])
+    table = np.array(list(rows), dtype=dtype)
+    table.flags.writeable = False
+    return {name: table[name] for name in names}
+
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    """Everything the dashboard shows for one calendar, date range and filter.
+
+    areas, types and projects are the top DASHBOARD_LIMIT rows of each, like
+    distinct_areas_by_date_range; daily and report are item's rows, like
+    area_daily_duration and area_report. item is "" when the filter has no
+    values in the range.
+    """
+
+    calendar: Record
+    start_date: str
+    end_date: str
+    filter_val: str
+    item: str
+    areas: tuple
+    types: tuple
+    projects: tuple
+    daily: tuple
+    report: Record
+
+    @property
+    def items(self):
+        """Names for the item list: the filter's top values"""
+        rows = {"Areas": self.areas, "Types": self.types, "Projects": self.projects}
+        return tuple(row.name for row in rows[self.filter_val])
+
+    @functools.cached_property
+    def daily_columns(self):
+        """daily as read-only arrays for the charts, see DAILY_DTYPES"""
+        return to_columns(self.daily, tuple(DAILY_DTYPES), DAILY_DTYPES)
+
+
+class QueryCache:
+    """Bounded LRU of CalendarModel results for one database generation.
+
+    Every entry is dropped once the database generation (bumped by the
+    importer on every change) differs from the one they were computed at,
+    and the least recently used entry once max_size is reached. max_size 0
+    turns caching off. Results are shared between callers: don't mutate them.
+    Safe to use from several threads; compute() runs outside the lock.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.generation = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key, generation, compute):
+        """Result cached for key at generation, else compute() and cache it"""
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        result = compute()
+        with self.lock:
+            if self.max_size and generation == self.generation:
+                self.entries[key] = result
+                if len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Hit/miss counts and fill, to tune max_size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+        }
+
+
+def cached(method):
+    """Serve a CalendarModel query from the database's QueryCache.
+
+    Keyed by method name and arguments with defaults filled in and dates
+    as YYYY-MM-DD, so get_top_areas(1, date(2024, 1, 1), "2024-01-31") and
+    get_top_areas(1, "2024-01-01", "2024-01-31", 10) share an entry.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__,) + tuple(
+            str(value) if isinstance(value, date) else value
+            for name, value in bound.arguments.items()
+            if name != "self"
+        )
+        return self.db.cache.lookup(
+            key, self.db.generation, lambda: method(self, *args, **kwargs)
+        )
+
+    return wrapper
 
 
 class CalendarModel:
     def __init__(self, db):
         self.db = db
 
+    @cached
     def get_calendars_by_usage(self) -> list[Record]:
         """Get calendars sorted by total duration (most used first)."""
+        if self.db.snapshot:
+            return [record(row) for row in self.db.snapshot.calendar_usage()]
+
         query = """
             SELECT 
                 c.id AS calendar_id,
@@ -53,11 +212,15 @@ class CalendarModel:
             GROUP BY c.id, c.name, c.color
             ORDER BY total_duration DESC;
             """
-        rows = self.db.fetch_all(query)
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query)
 
+    @cached
     def get_calendar_by_usage(self, calendar_id) -> list[Record]:
         """Get calendars sorted by total duration (most used first)."""
+        if self.db.snapshot:
+            rows = self.db.snapshot.calendar_usage(calendar_id)
+            return record(rows[0]) if rows else None
+
         query = """
             SELECT 
                 c.id AS calendar_id,
@@ -77,9 +240,80 @@ class CalendarModel:
             GROUP BY c.id, c.name, c.color
             ORDER BY total_duration DESC;
             """
-        row = self.db.fetch_one(query, (calendar_id,))
-        return Record(row)
+        return self.db.fetch_one(query, (calendar_id,))
+
+    def recurrence_window(self) -> tuple[date, date] | None:
+        """Dates the importer materialized recurring events for, None before any."""
+        rows = self.db.fetch_all(
+            """
+            SELECT key, value FROM settings
+            WHERE key IN ('recurrence_window_start', 'recurrence_window_end')
+            """
+        )
+        stored = {row.key: row.value for row in rows}
+        if len(stored) < 2:
+            return None
+        return (
+            date.fromisoformat(stored["recurrence_window_start"]),
+            date.fromisoformat(stored["recurrence_window_end"]),
+        )
+
+    @cached
+    def calendars_changed_since(self, generation) -> set[int]:
+        """Ids of calendars an import changed after generation."""
+        rows = self.db.fetch_all(
+            "SELECT calendar_id FROM manifest WHERE generation > ?", (generation,)
+        )
+        return {row.calendar_id for row in rows}
+
+    @cached
+    def get_duplicate_events(self, calendar_id=None, limit=None) -> list[Record]:
+        """Events stored more than once (same content hash), most hours counted twice first.
 
+        Groups come from one scan of idx_events_content_hash. With
+        calendar_id, only groups with a copy in that calendar.
+        duplicate_hours is what the extra copies add to usage totals.
+        """
+        query = """
+            WITH duplicates AS (
+                SELECT
+                    content_hash,
+                    MIN(id) AS event_id,
+                    COUNT(*) AS copies,
+                    COUNT(DISTINCT calendar_id) AS calendar_count,
+                    GROUP_CONCAT(DISTINCT calendar_id) AS calendar_ids,
+                    SUM(duration) - MAX(duration) AS duplicate_hours
+                FROM events
+                WHERE content_hash IS NOT NULL
+                GROUP BY content_hash
+                HAVING COUNT(*) > 1 AND (? IS NULL OR SUM(calendar_id = ?) > 0)
+            )
+            SELECT
+                d.content_hash,
+                e.summary,
+                e.dtstart,
+                e.dtend,
+                e.duration,
+                d.copies,
+                d.calendar_count,
+                d.calendar_ids,
+                d.duplicate_hours
+            FROM duplicates d
+            JOIN events e ON e.id = d.event_id
+            ORDER BY d.duplicate_hours DESC, e.dtstart
+            LIMIT ?
+        """
+        rows = self.db.fetch_all(
+            query, (calendar_id, calendar_id, -1 if limit is None else limit)
+        )
+        return [
+            row._replace(
+                calendar_ids=[int(id_) for id_ in row.calendar_ids.split(",")]
+            )
+            for row in rows
+        ]
+
+    @cached
     def get_calendars_alphabetically(self) -> list[Record]:
         """Get calendars sorted alphabetically by name."""
         query = """
@@ -94,9 +328,9 @@ class CalendarModel:
             GROUP BY c.id, c.name
             ORDER BY c.name
         """
-        rows = self.db.fetch_all(query)
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query)
 
+    @cached
     def get_top_areas(self, calendar_id: int, start_date: str, end_date: str, limit: int = 10) -> list[Record]:
         """Get top areas by total hours within a date range."""
         query = """
@@ -110,14 +344,16 @@ class CalendarModel:
             JOIN events e ON c.id = e.calendar_id
             JOIN areas a ON e.area_id = a.id
             WHERE c.id = ?
-              AND e.date BETWEEN ? AND ?
+              AND e.day_number BETWEEN ? AND ?
             GROUP BY c.name, a.name
             ORDER BY total_hours DESC
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
 
+    @cached
     def get_top_types(self, calendar_id: int, start_date, end_date, limit: int = 10) -> list[Record]:
         """Get top types by total hours within a date range."""
         query = """
@@ -134,14 +370,16 @@ class CalendarModel:
             JOIN types t ON e.type_id = t.id
             LEFT JOIN areas a ON e.area_id = a.id
             WHERE c.id = ?
-              AND e.date BETWEEN ? AND ?
+              AND e.day_number BETWEEN ? AND ?
             GROUP BY c.name, t.name, a.name
             ORDER BY total_hours DESC
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
 
+    @cached
     def get_top_projects(self, calendar_id: int, start_date, end_date, limit: int = 10) -> list[Record]:
         """Get top projects by total hours within a date range."""
         query = """
@@ -158,14 +396,16 @@ class CalendarModel:
             JOIN projects p ON e.project_id = p.id
             LEFT JOIN areas a ON p.area_id = a.id
             WHERE c.id = ?
-              AND e.date BETWEEN ? AND ?
+              AND e.day_number BETWEEN ? AND ?
             GROUP BY c.name, p.name, a.name
             ORDER BY total_hours DESC
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
 
+    @cached
     def distinct_areas(self, calendar_id):
         query = """
             SELECT DISTINCT t.name
@@ -174,9 +414,9 @@ class CalendarModel:
             WHERE e.calendar_id = ?
             ORDER BY t.name;
         """
-        rows = self.db.fetch_all(query, (calendar_id,))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id,))
 
+    @cached
     def distinct_types(self, calendar_id):
         query = """
             SELECT DISTINCT t.name
@@ -185,9 +425,9 @@ class CalendarModel:
             WHERE e.calendar_id = ?
             ORDER BY t.name;
         """
-        rows = self.db.fetch_all(query, (calendar_id,))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id,))
 
+    @cached
     def distinct_projects(self, calendar_id):
         query = """
             SELECT DISTINCT t.name
@@ -196,9 +436,9 @@ class CalendarModel:
             WHERE e.calendar_id = ?
             ORDER BY t.name;
         """
-        rows = self.db.fetch_all(query, (calendar_id,))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id,))
 
+    @cached
     def distinct_years(self, calendar_id):
         query = """
             SELECT DISTINCT 
@@ -210,9 +450,9 @@ class CalendarModel:
               AND c.id = ?
             ORDER BY year DESC;
         """
-        rows = self.db.fetch_all(query, (calendar_id,))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id,))
 
+    @cached
     def distinct_months(self, calendar_id):
         query = """
             SELECT DISTINCT 
@@ -224,9 +464,9 @@ class CalendarModel:
               AND c.id = ?
             ORDER BY month ASC;
         """
-        rows = self.db.fetch_all(query, (calendar_id,))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id,))
 
+    @cached
     def distinct_months_by_year(self, calendar_id, year: str):
         query = """
             SELECT DISTINCT 
@@ -239,244 +479,433 @@ class CalendarModel:
               AND SUBSTR(dtstart, 1, 4) = ?
             ORDER BY month ASC;
         """
-        rows = self.db.fetch_all(query, (calendar_id, year))
-        return [Record(row) for row in rows]
-
-    def distinct_areas_by_date_range(self, calendar_id, start_date, end_date, limit=5):
-        """Get distinct areas within a date range with their total hours and event count"""
-        query = """
-            SELECT DISTINCT 
-                a.id AS area_id,
-                a.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
-            FROM events e
-            JOIN areas a ON e.area_id = a.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
-              AND a.name IS NOT NULL
-            GROUP BY a.id, a.name
-            ORDER BY total_hours DESC
-            LIMIT ?
-        """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
-
-    def distinct_types_by_date_range(self, calendar_id, start_date, end_date, limit=5):
-        """Get distinct types within a date range with their total hours and event count"""
-        query = """
-            SELECT 
-                t.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
-            FROM events e
-            JOIN types t ON e.type_id = t.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
-              AND e.type_id IS NOT NULL
-            GROUP BY t.id, t.name
-            ORDER BY total_hours DESC
-            LIMIT ?
-        """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
-
-    def distinct_projects_by_date_range(self, calendar_id, start_date, end_date, limit=5):
-        """Get distinct projects within a date range with their total hours and event count"""
-        query = """
-            SELECT 
-                p.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
-            FROM events e
-            JOIN projects p ON e.project_id = p.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
-              AND e.project_id IS NOT NULL
-            GROUP BY p.id, p.name
-            ORDER BY total_hours DESC
-            LIMIT ?
-        """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(query, (calendar_id, year))
 
+    @cached
     def area_daily_duration(self, calendar_id, start_date, end_date, area_name):
-        """Get daily duration for a specific area within a date range"""
+        """Get daily duration for a specific area within a date range, split at midnight"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.daily_duration(
+                "area", calendar_id, start_date, end_date, area_name
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT 
-                e.date,
-                SUM(e.duration) as total_duration,
-                COUNT(*) as event_count
-            FROM events e
-            JOIN areas a ON e.area_id = a.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(r.day_number * 86400, 'unixepoch') AS date,
+                SUM(r.segment_hours) as total_duration,
+                SUM(r.segment_count) as event_count
+            FROM daily_rollups r
+            JOIN areas a ON r.dimension_id = a.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'area'
+              AND r.day_number BETWEEN ? AND ?
               AND a.name = ?
-            GROUP BY e.date
-            ORDER BY e.date;
+            GROUP BY r.day_number
+            ORDER BY r.day_number;
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, area_name))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), area_name)
+        )
 
+    @cached
     def type_daily_duration(self, calendar_id, start_date, end_date, type_name):
-        """Get daily duration for a specific type within a date range"""
+        """Get daily duration for a specific type within a date range, split at midnight"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.daily_duration(
+                "type", calendar_id, start_date, end_date, type_name
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT 
-                e.date,
-                SUM(e.duration) as total_duration,
-                COUNT(*) as event_count
-            FROM events e
-            JOIN types t ON e.type_id = t.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(r.day_number * 86400, 'unixepoch') AS date,
+                SUM(r.segment_hours) as total_duration,
+                SUM(r.segment_count) as event_count
+            FROM daily_rollups r
+            JOIN types t ON r.dimension_id = t.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'type'
+              AND r.day_number BETWEEN ? AND ?
               AND t.name = ?
-            GROUP BY e.date
-            ORDER BY e.date;
+            GROUP BY r.day_number
+            ORDER BY r.day_number;
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, type_name))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), type_name)
+        )
 
+    @cached
     def project_daily_duration(self, calendar_id, start_date, end_date, project_name):
-        """Get daily duration for a specific project within a date range"""
+        """Get daily duration for a specific project within a date range, split at midnight"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.daily_duration(
+                "project", calendar_id, start_date, end_date, project_name
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT 
-                e.date,
-                SUM(e.duration) as total_duration,
-                COUNT(*) as event_count
-            FROM events e
-            JOIN projects p ON e.project_id = p.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(r.day_number * 86400, 'unixepoch') AS date,
+                SUM(r.segment_hours) as total_duration,
+                SUM(r.segment_count) as event_count
+            FROM daily_rollups r
+            JOIN projects p ON r.dimension_id = p.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'project'
+              AND r.day_number BETWEEN ? AND ?
               AND p.name = ?
-            GROUP BY e.date
-            ORDER BY e.date;
+            GROUP BY r.day_number
+            ORDER BY r.day_number;
         """
-        rows = self.db.fetch_all(
-            query, (calendar_id, start_date, end_date, project_name)
+        return self.db.fetch_all(
+            query,
+            (calendar_id, day_number(start_date), day_number(end_date), project_name),
         )
-        return [Record(row) for row in rows]
 
+    @cached
     def area_report(self, calendar_id, start_date, end_date, area_name):
         """Get area report statistics within a date range"""
+        if self.db.snapshot:
+            return record(
+                self.db.snapshot.report("area", calendar_id, start_date, end_date, area_name)
+            )
+
         query = """
             SELECT 
-                MIN(e.date) AS first_date,
-                MAX(e.date) AS last_date,
-                SUM(e.duration) AS total_hours,
-                COUNT(DISTINCT e.date) AS total_days,
-                ROUND(SUM(e.duration) / COUNT(DISTINCT e.date), 2) AS average_day,
-                MAX(e.duration) AS max_duration,
-                MIN(e.duration) AS min_duration
-            FROM events e
-            JOIN areas a ON e.area_id = a.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(MIN(r.day_number) * 86400, 'unixepoch') AS first_date,
+                date(MAX(r.day_number) * 86400, 'unixepoch') AS last_date,
+                SUM(r.segment_hours) AS total_hours,
+                COUNT(DISTINCT r.day_number) AS total_days,
+                ROUND(SUM(r.segment_hours) / COUNT(DISTINCT r.day_number), 2) AS average_day,
+                MAX(r.max_duration) AS max_duration,
+                MIN(r.min_duration) AS min_duration
+            FROM daily_rollups r
+            JOIN areas a ON r.dimension_id = a.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'area'
+              AND r.day_number BETWEEN ? AND ?
               AND a.name = ?;
         """
-        row = self.db.fetch_one(query, (calendar_id, start_date, end_date, area_name))
-        return Record(row)
+        return self.db.fetch_one(
+            query, (calendar_id, day_number(start_date), day_number(end_date), area_name)
+        )
 
+    @cached
     def type_report(self, calendar_id, start_date, end_date, type_name):
         """Get type report statistics within a date range"""
+        if self.db.snapshot:
+            return record(
+                self.db.snapshot.report("type", calendar_id, start_date, end_date, type_name)
+            )
+
         query = """
             SELECT 
-                MIN(e.date) AS first_date,
-                MAX(e.date) AS last_date,
-                SUM(e.duration) AS total_hours,
-                COUNT(DISTINCT e.date) AS total_days,
-                ROUND(SUM(e.duration) / COUNT(DISTINCT e.date), 2) AS average_day,
-                MAX(e.duration) AS max_duration,
-                MIN(e.duration) AS min_duration
-            FROM events e
-            JOIN types t ON e.type_id = t.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(MIN(r.day_number) * 86400, 'unixepoch') AS first_date,
+                date(MAX(r.day_number) * 86400, 'unixepoch') AS last_date,
+                SUM(r.segment_hours) AS total_hours,
+                COUNT(DISTINCT r.day_number) AS total_days,
+                ROUND(SUM(r.segment_hours) / COUNT(DISTINCT r.day_number), 2) AS average_day,
+                MAX(r.max_duration) AS max_duration,
+                MIN(r.min_duration) AS min_duration
+            FROM daily_rollups r
+            JOIN types t ON r.dimension_id = t.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'type'
+              AND r.day_number BETWEEN ? AND ?
               AND t.name = ?;
         """
-        row = self.db.fetch_one(query, (calendar_id, start_date, end_date, type_name))
-        return Record(row)
+        return self.db.fetch_one(
+            query, (calendar_id, day_number(start_date), day_number(end_date), type_name)
+        )
 
+    @cached
     def project_report(self, calendar_id, start_date, end_date, project_name):
         """Get project report statistics within a date range"""
+        if self.db.snapshot:
+            return record(
+                self.db.snapshot.report("project", calendar_id, start_date, end_date, project_name)
+            )
+
         query = """
             SELECT 
-                MIN(e.date) AS first_date,
-                MAX(e.date) AS last_date,
-                SUM(e.duration) AS total_hours,
-                COUNT(DISTINCT e.date) AS total_days,
-                ROUND(SUM(e.duration) / COUNT(DISTINCT e.date), 2) AS average_day,
-                MAX(e.duration) AS max_duration,
-                MIN(e.duration) AS min_duration
-            FROM events e
-            JOIN projects p ON e.project_id = p.id
-            WHERE e.calendar_id = ?
-              AND e.date BETWEEN ? AND ?
+                date(MIN(r.day_number) * 86400, 'unixepoch') AS first_date,
+                date(MAX(r.day_number) * 86400, 'unixepoch') AS last_date,
+                SUM(r.segment_hours) AS total_hours,
+                COUNT(DISTINCT r.day_number) AS total_days,
+                ROUND(SUM(r.segment_hours) / COUNT(DISTINCT r.day_number), 2) AS average_day,
+                MAX(r.max_duration) AS max_duration,
+                MIN(r.min_duration) AS min_duration
+            FROM daily_rollups r
+            JOIN projects p ON r.dimension_id = p.id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'project'
+              AND r.day_number BETWEEN ? AND ?
               AND p.name = ?;
         """
-        row = self.db.fetch_one(query, (calendar_id, start_date, end_date, project_name))
-        return Record(row)
+        return self.db.fetch_one(
+            query, (calendar_id, day_number(start_date), day_number(end_date), project_name)
+        )
 
+    @cached
     def distinct_areas_by_date_range(self, calendar_id, start_date, end_date, limit=5):
         """Get distinct areas within a date range with their total hours and event count"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.totals_by(
+                "area", calendar_id, start_date, end_date, limit
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT DISTINCT 
                 a.id AS area_id,
                 a.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
-            FROM events e
-                JOIN areas a ON e.area_id = a.id
-            WHERE e.calendar_id = ?
-                AND e.date BETWEEN ? AND ?
+                SUM(r.total_hours) AS total_hours,
+                SUM(r.event_count) AS event_count
+            FROM daily_rollups r
+                JOIN areas a ON r.dimension_id = a.id
+            WHERE r.calendar_id = ?
+                AND r.kind = 'area'
+                AND r.day_number BETWEEN ? AND ?
                 AND a.name IS NOT NULL
-            GROUP BY a.id, a.name
-            ORDER BY total_hours DESC
+            GROUP BY r.dimension_id
+            HAVING SUM(r.event_count) > 0
+            ORDER BY total_hours DESC, r.dimension_id
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
 
+    @cached
     def distinct_types_by_date_range(self, calendar_id, start_date, end_date, limit=5):
         """Get distinct types within a date range with their total hours and event count"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.totals_by(
+                "type", calendar_id, start_date, end_date, limit
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT DISTINCT 
                 t.id AS type_id,
                 t.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
-            FROM events e
-                JOIN types t ON e.type_id = t.id
-            WHERE e.calendar_id = ?
-                AND e.date BETWEEN ? AND ?
+                SUM(r.total_hours) AS total_hours,
+                SUM(r.event_count) AS event_count
+            FROM daily_rollups r
+                JOIN types t ON r.dimension_id = t.id
+            WHERE r.calendar_id = ?
+                AND r.kind = 'type'
+                AND r.day_number BETWEEN ? AND ?
                 AND t.name IS NOT NULL
-            GROUP BY t.id, t.name
-            ORDER BY total_hours DESC
+            GROUP BY r.dimension_id
+            HAVING SUM(r.event_count) > 0
+            ORDER BY total_hours DESC, r.dimension_id
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
 
+    @cached
     def distinct_projects_by_date_range(
         self, calendar_id, start_date, end_date, limit=5
     ):
         """Get distinct projects within a date range with their total hours and event count"""
+        if self.db.snapshot:
+            rows = self.db.snapshot.totals_by(
+                "project", calendar_id, start_date, end_date, limit
+            )
+            return [record(row) for row in rows]
+
         query = """
             SELECT DISTINCT 
                 p.id AS project_id,
                 p.name AS name,
-                SUM(e.duration) AS total_hours,
-                COUNT(e.id) AS event_count
+                SUM(r.total_hours) AS total_hours,
+                SUM(r.event_count) AS event_count
+            FROM daily_rollups r
+                JOIN projects p ON r.dimension_id = p.id
+            WHERE r.calendar_id = ?
+                AND r.kind = 'project'
+                AND r.day_number BETWEEN ? AND ?
+                AND p.name IS NOT NULL
+            GROUP BY r.dimension_id
+            HAVING SUM(r.event_count) > 0
+            ORDER BY total_hours DESC, r.dimension_id
+            LIMIT ?
+        """
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), limit)
+        )
+
+    @cached
+    def distinct_facet_keys(self, calendar_id):
+        """Description keys (Difficulty, Tags, ...) used in a calendar besides area/type/project."""
+        query = """
+            SELECT DISTINCT f.key
             FROM events e
-                JOIN projects p ON e.project_id = p.id
+            JOIN event_facets ef ON ef.event_id = e.id
+            JOIN facets f ON f.id = ef.facet_id
             WHERE e.calendar_id = ?
-                AND e.date BETWEEN ? AND ?
-                AND p.name IS NOT NULL
-            GROUP BY p.id, p.name
-            ORDER BY total_hours DESC
+            ORDER BY f.key;
+        """
+        return self.db.fetch_all(query, (calendar_id,))
+
+    @cached
+    def distinct_facets_by_date_range(self, calendar_id, start_date, end_date, key, limit=5):
+        """Get the values of a facet key within a date range with their total hours and event count"""
+        query = """
+            SELECT
+                f.id AS facet_id,
+                f.value AS name,
+                SUM(r.total_hours) AS total_hours,
+                SUM(r.event_count) AS event_count
+            FROM daily_rollups r
+            JOIN facets f ON f.id = r.dimension_id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'facet'
+              AND r.day_number BETWEEN ? AND ?
+              AND f.key = ?
+            GROUP BY r.dimension_id
+            HAVING SUM(r.event_count) > 0
+            ORDER BY total_hours DESC, r.dimension_id
             LIMIT ?
         """
-        rows = self.db.fetch_all(query, (calendar_id, start_date, end_date, limit))
-        return [Record(row) for row in rows]
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), key, limit)
+        )
+
+    @cached
+    def facet_daily_duration(self, calendar_id, start_date, end_date, key, value):
+        """Get daily duration for one facet value within a date range, split at midnight"""
+        query = """
+            SELECT
+                date(r.day_number * 86400, 'unixepoch') AS date,
+                SUM(r.segment_hours) as total_duration,
+                SUM(r.segment_count) as event_count
+            FROM daily_rollups r
+            JOIN facets f ON f.id = r.dimension_id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'facet'
+              AND r.day_number BETWEEN ? AND ?
+              AND f.key = ?
+              AND f.value = ?
+            GROUP BY r.day_number
+            ORDER BY r.day_number;
+        """
+        return self.db.fetch_all(
+            query, (calendar_id, day_number(start_date), day_number(end_date), key, value)
+        )
+
+    @cached
+    def facet_report(self, calendar_id, start_date, end_date, key, value):
+        """Get facet value report statistics within a date range"""
+        query = """
+            SELECT
+                date(MIN(r.day_number) * 86400, 'unixepoch') AS first_date,
+                date(MAX(r.day_number) * 86400, 'unixepoch') AS last_date,
+                SUM(r.segment_hours) AS total_hours,
+                COUNT(DISTINCT r.day_number) AS total_days,
+                ROUND(SUM(r.segment_hours) / COUNT(DISTINCT r.day_number), 2) AS average_day,
+                MAX(r.max_duration) AS max_duration,
+                MIN(r.min_duration) AS min_duration
+            FROM daily_rollups r
+            JOIN facets f ON f.id = r.dimension_id
+            WHERE r.calendar_id = ?
+              AND r.kind = 'facet'
+              AND r.day_number BETWEEN ? AND ?
+              AND f.key = ?
+              AND f.value = ?;
+        """
+        return self.db.fetch_one(
+            query, (calendar_id, day_number(start_date), day_number(end_date), key, value)
+        )
+
+    def search_query(self, text):
+        """FTS5 query matching events that have every word of text as a word prefix."""
+        words = re.findall(r"\w+", text)
+        if not words:
+            return None
+        return " ".join(f'"{word}"*' for word in words)
+
+    @cached
+    def search_events(self, calendar_id, start_date, end_date, text, limit=50) -> list[Record]:
+        """Events whose summary or description match text, most recent first.
+
+        calendar_id None searches every calendar. Sorting by date is a
+        fraction of the cost of FTS5's relevance rank on large result sets.
+        """
+        match = self.search_query(text)
+        if not match:
+            return []
+
+        query = """
+            SELECT
+                e.id AS event_id,
+                c.id AS calendar_id,
+                c.name AS calendar_name,
+                e.summary,
+                e.description,
+                e.dtstart,
+                e.dtend,
+                e.date,
+                e.duration
+            FROM events_fts
+            JOIN events e ON e.id = events_fts.rowid
+            JOIN calendars c ON c.id = e.calendar_id
+            WHERE events_fts MATCH ?
+              AND (? IS NULL OR e.calendar_id = ?)
+              AND e.day_number BETWEEN ? AND ?
+            ORDER BY e.dtstart DESC
+            LIMIT ?
+        """
+        return self.db.fetch_all(
+            query,
+            (
+                match,
+                calendar_id,
+                calendar_id,
+                day_number(start_date),
+                day_number(end_date),
+                limit,
+            ),
+        )
+
+    @cached
+    def search_hours(self, calendar_id, start_date, end_date, text) -> list[Record]:
+        """Hours and event count per calendar of the events matching text, most hours first."""
+        match = self.search_query(text)
+        if not match:
+            return []
+
+        query = """
+            SELECT
+                c.id AS calendar_id,
+                c.name AS calendar_name,
+                SUM(e.duration) AS total_hours,
+                COUNT(e.id) AS event_count,
+                MIN(e.date) AS first_date,
+                MAX(e.date) AS last_date
+            FROM events_fts
+            JOIN events e ON e.id = events_fts.rowid
+            JOIN calendars c ON c.id = e.calendar_id
+            WHERE events_fts MATCH ?
+              AND (? IS NULL OR e.calendar_id = ?)
+              AND e.day_number BETWEEN ? AND ?
+            GROUP BY c.id, c.name
+            ORDER BY total_hours DESC
+        """
+        return self.db.fetch_all(
+            query,
+            (
+                match,
+                calendar_id,
+                calendar_id,
+                day_number(start_date),
+                day_number(end_date),
+            ),
+        )
 
     def distinct_values_by_filter(
         self,
@@ -540,46 +969,294 @@ class CalendarModel:
             print("Unkown filter value in update report.")
         return report
 
+    @cached
+    def dashboard_snapshot(self, calendar_id, start_date, end_date, filter_val, item=None):
+        """Dashboard data for one filter state as a DashboardSnapshot.
+
+        One statement reads the date range from daily_rollups once and
+        returns the top areas/types/projects, the item's days and the
+        calendar. item None picks the filter's top value, as a fresh item
+        list does. From the columnar snapshot when it is loaded.
+        """
+        kind = FILTER_KINDS.get(filter_val)
+        if kind is None:
+            raise ValueError(f"Unknown filter {filter_val!r}")
+        start_date, end_date = str(start_date), str(end_date)
+        if self.db.snapshot:
+            return self.snapshot_dashboard(
+                calendar_id, start_date, end_date, filter_val, item
+            )
+
+        query = """
+            WITH names (kind, id, name) AS (
+                SELECT 'area', id, name FROM areas
+                UNION ALL SELECT 'type', id, name FROM types
+                UNION ALL SELECT 'project', id, name FROM projects
+            ),
+            range AS MATERIALIZED (
+                SELECT *
+                FROM daily_rollups
+                WHERE calendar_id = :calendar_id
+                  AND kind IN ('area', 'type', 'project')
+                  AND day_number BETWEEN :start AND :end
+            ),
+            totals AS MATERIALIZED (
+                SELECT
+                    kind,
+                    dimension_id,
+                    SUM(total_hours) AS total_hours,
+                    SUM(event_count) AS event_count,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY kind
+                        ORDER BY SUM(total_hours) DESC, dimension_id
+                    ) AS rank
+                FROM range
+                GROUP BY kind, dimension_id
+                HAVING SUM(event_count) > 0
+            ),
+            item AS (
+                SELECT CASE
+                    WHEN :item IS NULL THEN
+                        (SELECT dimension_id FROM totals WHERE kind = :kind AND rank = 1)
+                    ELSE (SELECT id FROM names WHERE kind = :kind AND name = :item)
+                END AS id
+            )
+            SELECT 'calendar' AS part, NULL AS kind, id, name, color,
+                   NULL AS day_number, NULL AS hours, NULL AS count,
+                   NULL AS max_duration, NULL AS min_duration
+            FROM calendars WHERE id = :calendar_id
+            UNION ALL
+            SELECT 'totals', t.kind, t.dimension_id, n.name, NULL,
+                   NULL, t.total_hours, t.event_count, NULL, NULL
+            FROM totals t
+            JOIN names n ON n.kind = t.kind AND n.id = t.dimension_id
+            WHERE t.rank <= :limit
+            UNION ALL
+            SELECT 'daily', r.kind, r.dimension_id, NULL, NULL,
+                   r.day_number, r.segment_hours, r.segment_count,
+                   r.max_duration, r.min_duration
+            FROM range r
+            JOIN item i ON i.id = r.dimension_id
+            WHERE r.kind = :kind
+            ORDER BY part, kind, day_number, hours DESC, id
+        """
+        rows = self.db.fetch_all(
+            query,
+            {
+                "calendar_id": calendar_id,
+                "start": day_number(start_date),
+                "end": day_number(end_date),
+                "kind": kind,
+                "item": item,
+                "limit": DASHBOARD_LIMIT,
+            },
+        )
+
+        calendar = None
+        totals = {"area": [], "type": [], "project": []}
+        daily = []
+        for row in rows:
+            if row.part == "calendar":
+                calendar = record(
+                    {
+                        "calendar_id": row.id,
+                        "calendar_name": row.name,
+                        "calendar_color": row.color,
+                    }
+                )
+            elif row.part == "totals":
+                totals[row.kind].append(
+                    record(
+                        {
+                            f"{row.kind}_id": row.id,
+                            "name": row.name,
+                            "total_hours": row.hours,
+                            "event_count": row.count,
+                        }
+                    )
+                )
+            else:
+                daily.append(row)
+
+        if item is None:
+            item = totals[kind][0].name if totals[kind] else ""
+        return DashboardSnapshot(
+            calendar=calendar,
+            start_date=start_date,
+            end_date=end_date,
+            filter_val=filter_val,
+            item=item,
+            areas=tuple(totals["area"]),
+            types=tuple(totals["type"]),
+            projects=tuple(totals["project"]),
+            daily=tuple(
+                record(
+                    {
+                        "date": day_string(row.day_number),
+                        "total_duration": row.hours,
+                        "event_count": row.count,
+                    }
+                )
+                for row in daily
+            ),
+            report=record(self.daily_report(daily)),
+        )
+
+    def daily_report(self, daily):
+        """area_report and friends' figures from an item's daily_rollups rows"""
+        if not daily:
+            return {
+                "first_date": None,
+                "last_date": None,
+                "total_hours": None,
+                "total_days": 0,
+                "average_day": None,
+                "max_duration": None,
+                "min_duration": None,
+            }
+        total_hours = sum(row.hours for row in daily)
+        return {
+            "first_date": day_string(daily[0].day_number),
+            "last_date": day_string(daily[-1].day_number),
+            "total_hours": total_hours,
+            "total_days": len(daily),
+            "average_day": sql_round(total_hours / len(daily), 2),
+            "max_duration": max(row.max_duration for row in daily),
+            "min_duration": min(row.min_duration for row in daily),
+        }
+
+    def snapshot_dashboard(self, calendar_id, start_date, end_date, filter_val, item):
+        """dashboard_snapshot from the columnar snapshot"""
+        snapshot = self.db.snapshot
+        kind = FILTER_KINDS[filter_val]
+        totals = {
+            name: tuple(
+                record(row)
+                for row in snapshot.totals_by(
+                    name, calendar_id, start_date, end_date, DASHBOARD_LIMIT
+                )
+            )
+            for name in FILTER_KINDS.values()
+        }
+        if item is None:
+            item = totals[kind][0].name if totals[kind] else ""
+        calendar = next(
+            (
+                record(row)
+                for row in snapshot.calendars
+                if row["calendar_id"] == calendar_id
+            ),
+            None,
+        )
+        daily = snapshot.daily_duration(kind, calendar_id, start_date, end_date, item)
+        return DashboardSnapshot(
+            calendar=calendar,
+            start_date=start_date,
+            end_date=end_date,
+            filter_val=filter_val,
+            item=item,
+            areas=totals["area"],
+            types=totals["type"],
+            projects=totals["project"],
+            daily=tuple(record(row) for row in daily),
+            report=record(
+                snapshot.report(kind, calendar_id, start_date, end_date, item)
+            ),
+        )
+
 
 
 class DatabaseManager:
+    """
+    Queries db_path through a ConnectionPool: fetch_* read on a pooled
+    read-only connection, so any thread may call them, also while an
+    import writes; execute writes through the pool's single writer.
+    """
+
     def __init__(self):
         self.db_path = Path(DB_FILE)
-        self.conn = None
+        self.pool = None
         self.calendar_model = None
+        self.snapshot = None
+        self.generation = 0
+        self.cache = QueryCache()
         self._init_db()
 
     def _init_db(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
-        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.pool = ConnectionPool(self.db_path)
+        self.load_snapshot()
 
         self.model = CalendarModel(self)
 
+    def swap(self):
+        """Pick up what an importer installed into db_path.
+
+        Imports are written into the live file in one write transaction
+        (a sync in place, a rebuild by converter.install_database), so
+        pooled connections read them as soon as they commit. This loads
+        the matching snapshot and generation, which also retires cached
+        results.
+        """
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        """Map the importer's events snapshot if it matches the database.
+
+        CalendarModel answers aggregates from it while set, from SQLite
+        when it is None (missing or written for another generation).
+        """
+        with self.pool.reader() as conn:
+            self.generation = read_generation(conn)
+        self.snapshot = EventSnapshot.load(self.db_path, self.generation)
+
+    def has_changed(self):
+        """True if an importer changed the database since it was loaded."""
+        try:
+            with self.pool.reader() as conn:
+                return read_generation(conn) != self.generation
+        except sqlite3.Error:
+            # Busy past the timeout, look again next time
+            return False
+
     def close(self):
-        if self.conn:
-            self.conn.commit()
-            self.conn.close()
+        if self.pool:
+            self.pool.close()
 
     def execute(self, query, params=()):
-        try:
-            self.cursor.execute(query, params)
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"Database error: {e}")
-            self.conn.rollback()
-            raise
+        with self.pool.writer() as conn:
+            try:
+                conn.execute(query, params)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Database error: {e}")
+                conn.rollback()
+                raise
 
     def fetch_one(self, query, params=()):
-        self.cursor.execute(query, params)
-        row = self.cursor.fetchone()
-        return dict(row) if row else None
+        with self.pool.reader() as conn:
+            cursor = conn.execute(query, params)
+            row = cursor.fetchone()
+            return row_type(column_names(cursor))._make(row) if row else None
 
     def fetch_all(self, query, params=()):
-        self.cursor.execute(query, params)
-        rows = self.cursor.fetchall()
-        return [dict(row) for row in rows]
+        """Rows as the query's Record type.
+
+        Fetched as plain tuples and retyped in C: no dict or wrapper per row.
+        """
+        with self.pool.reader() as conn:
+            cursor = conn.execute(query, params)
+            rows = cursor.fetchall()
+            names = column_names(cursor)
+        make = functools.partial(tuple.__new__, row_type(names))
+        return list(map(make, rows))
+
+    def fetch_columns(self, query, params=(), dtypes=None):
+        """Result columns as read-only NumPy arrays, see to_columns"""
+        with self.pool.reader() as conn:
+            cursor = conn.execute(query, params)
+            rows = cursor.fetchall()
+            names = column_names(cursor)
+        return to_columns(rows, names, dtypes or {})
 
     def __enter__(self):
         return self
@@ -0,0 +1,327 @@
+"""snapshot.py: columnar, memory-mapped copy of the event segments.
+
+The importer writes one next to the database after every import (see
+converter.write_snapshot). The file holds one typed NumPy array per column,
+one row per event per day (event_segments joined with events), rows sorted
+by calendar and date, plus a JSON header with the database
+generation it was taken at and the lookup table names. The app maps it at
+startup and answers dashboard aggregates from it while its generation
+matches the database; otherwise CalendarModel queries SQLite.
+
+Layout: MAGIC, header length (uint64, little endian), JSON header, then,
+from the next ALIGNMENT boundary, the column arrays at the offsets the
+header lists, each ALIGNMENT aligned.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"GCALSNP2"
+ALIGNMENT = 64
+# Rows read from SQLite at a time while writing
+CHUNK_SIZE = 100_000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# julianday() of 1970-01-01
+JULIAN_EPOCH = 2440587.5
+
+# (column, dtype, SQL expression) over event_segments s JOIN events e;
+# lookup ids are 0 when NULL. duration is the hours on that day,
+# event_duration the whole event's and first marks the event's start day.
+COLUMNS = (
+    ("calendar_id", "<i4", "s.calendar_id"),
+    ("area_id", "<i4", "COALESCE(e.area_id, 0)"),
+    ("type_id", "<i4", "COALESCE(e.type_id, 0)"),
+    ("project_id", "<i4", "COALESCE(e.project_id, 0)"),
+    ("day", "<i4", f"CAST(julianday(s.date) - {JULIAN_EPOCH} AS INTEGER)"),
+    ("duration", "<f8", "s.duration"),
+    ("event_duration", "<f8", "e.duration"),
+    ("first", "u1", "s.date = e.date"),
+)
+LOOKUP_TABLES = ("areas", "types", "projects")
+# lookup kind -> (column, table)
+KINDS = {
+    "area": ("area_id", "areas"),
+    "type": ("type_id", "types"),
+    "project": ("project_id", "projects"),
+}
+
+
+def snapshot_path(db_path):
+    return Path(db_path).with_suffix(".snapshot")
+
+
+def read_generation(conn):
+    """Generation counter the importer bumps on every change, 0 if unset"""
+    try:
+        row = conn.execute(
+            "SELECT value FROM settings WHERE key = 'generation'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Database from before the settings table
+        return 0
+    return int(row[0]) if row else 0
+
+
+def day_number(value):
+    """Days since 1970-01-01 of a date or YYYY-MM-DD string"""
+    return date.fromisoformat(str(value)).toordinal() - EPOCH_ORDINAL
+
+
+def day_string(day):
+    return date.fromordinal(int(day) + EPOCH_ORDINAL).isoformat()
+
+
+def sql_round(value, digits):
+    """SQLite's ROUND: halves away from zero, where round() goes to even"""
+    exponent = Decimal(1).scaleb(-digits)
+    return float(Decimal(repr(value)).quantize(exponent, ROUND_HALF_UP))
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(db_path):
+    """Write the snapshot of db_path's event segments, return its path"""
+    path = snapshot_path(db_path)
+    tmp_path = Path(f"{path}.tmp")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        generation = read_generation(conn)
+        lookups = {
+            "calendars": [
+                list(row) for row in conn.execute("SELECT id, name, color FROM calendars")
+            ]
+        }
+        for table in LOOKUP_TABLES:
+            lookups[table] = [
+                list(row) for row in conn.execute(f"SELECT id, name FROM {table}")
+            ]
+
+        dtype = np.dtype([(name, kind) for name, kind, _ in COLUMNS])
+        cursor = conn.execute(
+            f"SELECT {', '.join(sql for _, _, sql in COLUMNS)} "
+            "FROM event_segments s JOIN events e ON e.id = s.event_id "
+            "ORDER BY s.calendar_id, s.date"
+        )
+        chunks = []
+        while rows := cursor.fetchmany(CHUNK_SIZE):
+            chunks.append(np.array(rows, dtype=dtype))
+    finally:
+        conn.close()
+
+    table = np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+    # Column offsets are relative to the start of the data
+    columns = []
+    offset = 0
+    for name, kind, _ in COLUMNS:
+        offset = align(offset)
+        columns.append({"name": name, "dtype": kind, "offset": offset})
+        offset += table.dtype[name].itemsize * len(table)
+
+    header = json.dumps(
+        {
+            "generation": generation,
+            "rows": len(table),
+            "columns": columns,
+            "lookups": lookups,
+        }
+    ).encode()
+    data_start = align(len(MAGIC) + 8 + len(header))
+
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for column in columns:
+            f.seek(data_start + column["offset"])
+            f.write(np.ascontiguousarray(table[column["name"]]).tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+class EventSnapshot:
+    """Read-only view of a snapshot file, answering CalendarModel aggregates"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an events snapshot")
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length))
+
+        self.generation = header["generation"]
+        self.rows = header["rows"]
+        # mmap can't map past the end of the file, which an empty table ends at
+        buffer = np.memmap(path, dtype=np.uint8, mode="r") if self.rows else b""
+        data_start = align(len(MAGIC) + 8 + length) if self.rows else 0
+        self.columns = {
+            column["name"]: np.frombuffer(
+                buffer,
+                dtype=column["dtype"],
+                count=self.rows,
+                offset=data_start + column["offset"] if self.rows else 0,
+            )
+            for column in header["columns"]
+        }
+
+        lookups = header["lookups"]
+        self.calendars = [
+            {"calendar_id": id_, "calendar_name": name, "calendar_color": color}
+            for id_, name, color in lookups["calendars"]
+        ]
+        # table -> {id: name}
+        self.names = {
+            table: {id_: name for id_, name in lookups[table]}
+            for table in LOOKUP_TABLES
+        }
+
+    @classmethod
+    def load(cls, db_path, generation):
+        """Snapshot of db_path if it exists and is at generation, else None"""
+        path = snapshot_path(db_path)
+        try:
+            snapshot = cls(path)
+        except (OSError, ValueError) as e:
+            if path.exists():
+                print(f"Ignoring snapshot {path}: {e}")
+            return None
+        if snapshot.generation != generation:
+            return None
+        return snapshot
+
+    def calendar_rows(self, calendar_id):
+        """Slice of the rows of calendar_id (rows are sorted by calendar)"""
+        calendar_ids = self.columns["calendar_id"]
+        return slice(
+            np.searchsorted(calendar_ids, calendar_id, "left"),
+            np.searchsorted(calendar_ids, calendar_id, "right"),
+        )
+
+    def range_rows(self, calendar_id, start_date, end_date):
+        """Slice of the rows of calendar_id dated start_date..end_date"""
+        rows = self.calendar_rows(calendar_id)
+        days = self.columns["day"][rows]
+        return slice(
+            rows.start + np.searchsorted(days, day_number(start_date), "left"),
+            rows.start + np.searchsorted(days, day_number(end_date), "right"),
+        )
+
+    def calendar_usage(self, calendar_id=None):
+        """Per calendar totals, most used first, like get_calendars_by_usage"""
+        usage = []
+        for calendar in self.calendars:
+            if calendar_id is not None and calendar["calendar_id"] != calendar_id:
+                continue
+            rows = self.calendar_rows(calendar["calendar_id"])
+            first = self.columns["first"][rows].astype(bool)
+            distinct = {}
+            for kind, (column, _) in KINDS.items():
+                ids = self.columns[column][rows]
+                distinct[f"distinct_{kind}s"] = len(np.unique(ids[ids > 0]))
+            usage.append(
+                {
+                    **calendar,
+                    "total_duration": float(self.columns["duration"][rows].sum()),
+                    "total_events": int(first.sum()),
+                    **distinct,
+                }
+            )
+        usage.sort(key=lambda row: row["total_duration"], reverse=True)
+        return usage
+
+    def totals_by(self, kind, calendar_id, start_date, end_date, limit):
+        """
+        Hours and event count per area/type/project in a date range, most
+        hours first, like distinct_areas_by_date_range and friends. Events
+        count in full on the day they start.
+        """
+        column, table = KINDS[kind]
+        rows = self.range_rows(calendar_id, start_date, end_date)
+        first = self.columns["first"][rows].astype(bool)
+        ids = self.columns[column][rows][first]
+        names = self.names[table]
+        size = max(names, default=0) + 1
+        hours = np.bincount(
+            ids, weights=self.columns["event_duration"][rows][first], minlength=size
+        )
+        counts = np.bincount(ids, minlength=size)
+
+        found = [id_ for id_ in np.flatnonzero(counts) if id_ in names]
+        found.sort(key=lambda id_: hours[id_], reverse=True)
+        return [
+            {
+                f"{kind}_id": int(id_),
+                "name": names[id_],
+                "total_hours": float(hours[id_]),
+                "event_count": int(counts[id_]),
+            }
+            for id_ in found[:limit]
+        ]
+
+    def item_rows(self, kind, calendar_id, start_date, end_date, name):
+        """
+        (days, hours, event durations) of the segments of one
+        area/type/project by name
+        """
+        column, table = KINDS[kind]
+        rows = self.range_rows(calendar_id, start_date, end_date)
+        ids = [id_ for id_, item_name in self.names[table].items() if item_name == name]
+        mask = np.isin(self.columns[column][rows], ids)
+        return (
+            self.columns["day"][rows][mask],
+            self.columns["duration"][rows][mask],
+            self.columns["event_duration"][rows][mask],
+        )
+
+    def daily_duration(self, kind, calendar_id, start_date, end_date, name):
+        """Hours and event count per date for one area/type/project"""
+        days, durations, _ = self.item_rows(kind, calendar_id, start_date, end_date, name)
+        if not len(days):
+            return []
+        unique_days, starts, counts = np.unique(
+            days, return_index=True, return_counts=True
+        )
+        hours = np.add.reduceat(durations, starts)
+        return [
+            {
+                "date": day_string(day),
+                "total_duration": float(total),
+                "event_count": int(count),
+            }
+            for day, total, count in zip(unique_days, hours, counts)
+        ]
+
+    def report(self, kind, calendar_id, start_date, end_date, name):
+        """First/last date, total and per day hours for one area/type/project"""
+        days, durations, event_durations = self.item_rows(
+            kind, calendar_id, start_date, end_date, name
+        )
+        if not len(days):
+            return {
+                "first_date": None,
+                "last_date": None,
+                "total_hours": None,
+                "total_days": 0,
+                "average_day": None,
+                "max_duration": None,
+                "min_duration": None,
+            }
+        total_hours = float(durations.sum())
+        total_days = len(np.unique(days))
+        return {
+            "first_date": day_string(days.min()),
+            "last_date": day_string(days.max()),
+            "total_hours": total_hours,
+            "total_days": total_days,
+            "average_day": sql_round(total_hours / total_days, 2),
+            "max_duration": float(event_durations.max()),
+            "min_duration": float(event_durations.min()),
+        }
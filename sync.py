@@ -0,0 +1,150 @@
+"""sync.py: headless sync of a watched folder into data.db.
+
+Polls a folder for new or changed .ics files and Google Calendar export
+zips and imports them incrementally: only calendars whose file changed are
+parsed and only their changed events are written. A running app notices
+the new database generation and refreshes the calendars that changed.
+
+    python sync.py                            # watch ics/
+    python sync.py --folder ~/Downloads       # watch a drop folder
+    python sync.py --once                     # sync what is there and exit
+"""
+
+import argparse
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+
+import converter
+
+POLL_SECONDS = 10
+PATTERNS = ("*.ics", "*.zip")
+
+
+def scan(folder):
+    """{path: (size, mtime)} of the ICS and zip files in folder"""
+    found = {}
+    for pattern in PATTERNS:
+        for path in folder.glob(pattern):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Removed while scanning
+                continue
+            found[path] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+def sources(paths):
+    """ICS paths and the calendars inside zip files"""
+    for path in sorted(paths):
+        if path.suffix == ".zip":
+            yield from converter.zip_members(path)
+        else:
+            yield path
+
+
+def sync(paths, output_db_file="data.db", stats=None, dedupe="calendar"):
+    """
+    Import ICS and zip files into output_db_file. Calendars with no file
+    in paths are kept: a drop folder rarely holds every calendar. Calendars
+    from zips are written to ICS_DIR, as import_zip does.
+    """
+    ics_files = list(sources(paths))
+    total_events = converter.import_sources(
+        ics_files,
+        output_db_file,
+        incremental=True,
+        stats=stats,
+        prune=False,
+        dedupe=dedupe,
+    )
+    members = [
+        ics_file for ics_file in ics_files if isinstance(ics_file, converter.ZipMember)
+    ]
+    converter.write_members(members, converter.ICS_DIR)
+    return total_events
+
+
+class FolderWatcher:
+    """Poll a folder and sync its files once they stop changing"""
+
+    def __init__(
+        self,
+        folder,
+        output_db_file="data.db",
+        interval=POLL_SECONDS,
+        dedupe="calendar",
+    ):
+        self.folder = Path(folder).expanduser()
+        self.output_db_file = output_db_file
+        self.interval = interval
+        self.dedupe = dedupe
+        # path -> (size, mtime) seen by the last poll
+        self.seen = {}
+        # path -> (size, mtime) when it was last synced
+        self.synced = {}
+
+    def poll(self):
+        """Sync files that changed since they were last synced, return the paths"""
+        current = scan(self.folder)
+        # Unchanged since the last poll, so not a download still being written
+        settled = {
+            path: fingerprint
+            for path, fingerprint in current.items()
+            if self.seen.get(path) == fingerprint
+        }
+        self.seen = current
+
+        changed = [
+            path
+            for path, fingerprint in settled.items()
+            if self.synced.get(path) != fingerprint
+        ]
+        if not changed:
+            return []
+
+        print(f"Syncing {', '.join(path.name for path in sorted(changed))}...")
+        try:
+            sync(changed, self.output_db_file, dedupe=self.dedupe)
+        except (OSError, sqlite3.Error, zipfile.BadZipFile) as e:
+            # Not marked synced: tried again on the next poll
+            print(f"Sync failed: {e}")
+            return []
+        for path in changed:
+            self.synced[path] = settled[path]
+        return changed
+
+    def run(self):
+        print(f"Watching {self.folder} every {self.interval}s, Ctrl+C to stop")
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("Stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync ICS and zip files into data.db.")
+    parser.add_argument("--folder", type=Path, default=converter.ICS_DIR)
+    parser.add_argument("--db", default="data.db", help="database file in db/")
+    parser.add_argument("--interval", type=float, default=POLL_SECONDS)
+    parser.add_argument("--once", action="store_true", help="sync once and exit")
+    parser.add_argument(
+        "--dedupe",
+        choices=converter.DEDUPE_POLICIES,
+        default="calendar",
+        help="keep copies of events, or drop those in the same calendar or in any",
+    )
+    args = parser.parse_args()
+
+    if args.once:
+        sync(scan(args.folder.expanduser()), args.db, dedupe=args.dedupe)
+    else:
+        FolderWatcher(args.folder, args.db, args.interval, args.dedupe).run()
+
+
+if __name__ == "__main__":
+    main()
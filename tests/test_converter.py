@@ -0,0 +1,208 @@
+"""Recurrence expansion and incremental sync of converter.IcsToDb."""
+
+import os
+import sqlite3
+from datetime import date
+
+import converter
+
+WINDOW = (date(2024, 1, 1), date(2024, 1, 31))
+
+CALENDAR = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//test//EN
+X-WR-CALNAME:work
+X-WR-TIMEZONE:UTC
+{events}END:VCALENDAR
+"""
+
+# Daily standup, 1 Jan - 10 Jan 2024: 3 Jan is cancelled and 5 Jan
+# moved to the afternoon and made two hours long
+STANDUP = """BEGIN:VEVENT
+UID:standup@test
+DTSTART:20240101T090000Z
+DTEND:20240101T100000Z
+RRULE:FREQ=DAILY;COUNT=10
+EXDATE:20240103T090000Z
+SUMMARY:Standup
+DESCRIPTION:Area: Work\\nType: Meeting
+END:VEVENT
+BEGIN:VEVENT
+UID:standup@test
+RECURRENCE-ID:20240105T090000Z
+DTSTART:20240105T140000Z
+DTEND:20240105T160000Z
+SUMMARY:Standup
+DESCRIPTION:Area: Work\\nType: Meeting
+END:VEVENT
+"""
+
+# Weekly review on Mondays, from 4 Dec 2023 to 26 Feb 2024
+REVIEW = """BEGIN:VEVENT
+UID:review@test
+DTSTART:20231204T150000Z
+DTEND:20231204T160000Z
+RRULE:FREQ=WEEKLY;UNTIL=20240226T150000Z
+SUMMARY:Review
+DESCRIPTION:Area: Work\\nType: Planning
+END:VEVENT
+"""
+
+
+def single(uid, day, hours, area="Work"):
+    return f"""BEGIN:VEVENT
+UID:{uid}
+DTSTART:{day}T090000Z
+DTEND:{day}T{9 + hours:02d}0000Z
+SUMMARY:{uid}
+DESCRIPTION:Area: {area}\\nType: Focus
+END:VEVENT
+"""
+
+
+def write_calendar(path, events, mtime):
+    path.write_text(CALENDAR.format(events="".join(events)), newline="\r\n")
+    # A fixed mtime per version: sync skips files no newer than the last import
+    os.utime(path, (mtime, mtime))
+
+
+def query(db_file, sql):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(sql).fetchall()
+    conn.close()
+    return rows
+
+
+def events(db_file):
+    """{(summary, date): duration} of the stored events"""
+    rows = query(db_file, "SELECT summary, date, duration FROM events")
+    assert len(rows) == len({(summary, day) for summary, day, _ in rows})
+    return {(summary, day): duration for summary, day, duration in rows}
+
+
+def assert_rollups(db_file):
+    """Area and type rollups hold the totals of the stored events"""
+    for kind, column in (("area", "area_id"), ("type", "type_id")):
+        rollups = query(
+            db_file,
+            f"""
+            SELECT day_number, dimension_id, total_hours, event_count
+            FROM daily_rollups WHERE kind = '{kind}'
+            ORDER BY day_number, dimension_id
+            """,
+        )
+        expected = query(
+            db_file,
+            f"""
+            SELECT day_number, {column}, SUM(duration), COUNT(*)
+            FROM events GROUP BY day_number, {column}
+            ORDER BY day_number, {column}
+            """,
+        )
+        assert rollups == expected
+
+
+def work_hours(db_file):
+    """{date: total hours} of the Work area, from daily_rollups"""
+    rows = query(
+        db_file,
+        f"""
+        SELECT date(r.day_number + {converter.JULIAN_EPOCH}), r.total_hours
+        FROM daily_rollups r JOIN areas a ON a.id = r.dimension_id
+        WHERE r.kind = 'area' AND a.name = 'work'
+        """,
+    )
+    return dict(rows)
+
+
+def test_exdate_and_override(tmp_path):
+    db_file = tmp_path / "data.db"
+    ics_file = tmp_path / "work.ics"
+    write_calendar(ics_file, [STANDUP], 1_700_000_000)
+
+    converter.IcsToDb(db_file, recurrence_window=WINDOW).import_calendar(ics_file)
+
+    stored = events(db_file)
+    days = sorted(day for summary, day in stored)
+    assert days == [f"2024-01-{day:02d}" for day in (1, 2, 4, 5, 6, 7, 8, 9, 10)]
+    assert stored[("Standup", "2024-01-05")] == 2.0
+    assert stored[("Standup", "2024-01-04")] == 1.0
+    assert query(
+        db_file,
+        "SELECT dtstart FROM events WHERE recurrence_id = '20240105T090000'",
+    ) == [("20240105T140000",)]
+
+    assert_rollups(db_file)
+    hours = work_hours(db_file)
+    assert "2024-01-03" not in hours
+    assert hours["2024-01-05"] == 2.0
+
+
+def test_window_extension(tmp_path):
+    db_file = tmp_path / "data.db"
+    ics_file = tmp_path / "work.ics"
+    write_calendar(ics_file, [REVIEW], 1_700_000_000)
+
+    converter.IcsToDb(db_file, recurrence_window=WINDOW).import_calendar(ics_file)
+    january = ["2024-01-01", "2024-01-08", "2024-01-15", "2024-01-22", "2024-01-29"]
+    assert sorted(day for _, day in events(db_file)) == january
+
+    importer = converter.IcsToDb(db_file)
+    assert importer.extend_recurrence_window(date(2023, 12, 1), date(2024, 2, 29))
+    december = ["2023-12-04", "2023-12-11", "2023-12-18", "2023-12-25"]
+    february = ["2024-02-05", "2024-02-12", "2024-02-19", "2024-02-26"]
+    assert sorted(day for _, day in events(db_file)) == december + january + february
+    assert_rollups(db_file)
+    assert sorted(work_hours(db_file)) == december + january + february
+
+    # Already covered: nothing to write
+    importer = converter.IcsToDb(db_file)
+    assert not importer.extend_recurrence_window(date(2023, 12, 1), date(2024, 1, 31))
+    assert len(events(db_file)) == 13
+
+
+def test_incremental_sync_updates_and_deletes(tmp_path):
+    db_file = tmp_path / "data.db"
+    ics_file = tmp_path / "work.ics"
+    write_calendar(
+        ics_file,
+        [
+            STANDUP,
+            single("write", "20240102", 2),
+            single("read", "20240103", 1),
+            single("gym", "20240104", 1, area="Health"),
+        ],
+        1_700_000_000,
+    )
+    converter.IcsToDb(db_file, recurrence_window=WINDOW).import_calendar(ics_file)
+    assert len(events(db_file)) == 12
+    assert work_hours(db_file)["2024-01-02"] == 3.0
+    gym = query(db_file, "SELECT id, content_hash FROM events WHERE summary = 'gym'")
+
+    # "write" grows to three hours, "read" and the 9 Jan standup are gone
+    standup = STANDUP.replace(
+        "EXDATE:20240103T090000Z", "EXDATE:20240103T090000Z,20240109T090000Z"
+    )
+    write_calendar(
+        ics_file,
+        [standup, single("write", "20240102", 3), single("gym", "20240104", 1, "Health")],
+        1_700_000_100,
+    )
+    converter.IcsToDb(db_file, recurrence_window=WINDOW).sync_calendar(ics_file)
+
+    stored = events(db_file)
+    assert stored[("write", "2024-01-02")] == 3.0
+    assert ("read", "2024-01-03") not in stored
+    assert ("Standup", "2024-01-09") not in stored
+    assert len(stored) == 10
+    # Unchanged events are left in place
+    assert query(
+        db_file, "SELECT id, content_hash FROM events WHERE summary = 'gym'"
+    ) == gym
+
+    assert_rollups(db_file)
+    hours = work_hours(db_file)
+    assert hours["2024-01-02"] == 4.0
+    assert "2024-01-03" not in hours
+    assert "2024-01-09" not in hours
+    assert query(db_file, "SELECT COUNT(*) FROM event_segments") == [(10,)]
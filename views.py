@@ -414,7 +414,8 @@ class CalendarView(ttk.Frame):
         self.update_card_style()
 
     def create_cards(self, calendars):
-        for i, calendar in enumerate(calendars):
+        # calendars added later get the next columns
+        for i, calendar in enumerate(calendars, start=len(self.cards)):
             card = ttk.Frame(self, relief="sunken", padding=10)
             # reference to calendar id to use in event
             card.calendar_id = calendar.calendar_id
@@ -441,6 +442,22 @@ class CalendarView(ttk.Frame):
                 if child.widgetName == "ttk::label":
                     child.bind("<Button-1>", self.on_label_select)
 
+    def remove_cards(self, calendar_ids):
+        for calendar_id in calendar_ids:
+            self.cards.pop(calendar_id).destroy()
+        # close the gaps in the row
+        for i, card in enumerate(self.cards.values()):
+            card.grid_configure(column=i)
+
+        if not self.cards:
+            return
+        if self.selected_calendar_id not in self.cards:
+            # selected calendar is gone, select the first one
+            self.selected_calendar_id = next(iter(self.cards))
+        self.prev_card = self.cards[self.selected_calendar_id]
+        self.current_card = self.cards[self.selected_calendar_id]
+        self.update_card_style()
+
     def update_card(self, calendar):
         card = self.cards.get(calendar.calendar_id)
         card.name_label.config(text=calendar.calendar_name.title())
@@ -477,9 +494,20 @@ class ActionView(ttk.Frame):
         open_button = ttk.Button(self, text="open", command=self.on_open_button)
         open_button.grid(row=1, column=0, sticky="nswe", pady=20)
 
+        # Import progress
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.status_var, wraplength=150).grid(
+            row=2, column=0, sticky="nswe"
+        )
+
     def register_event_handler(self, event_name, handler):
         self.handlers[event_name] = handler
 
+    def update_status(self, text):
+        self.status_var.set(text)
+        # import runs on the ui thread, redraw now
+        self.update_idletasks()
+
     def switch_theme(self):
         if self.theme_check_var.get():
             self.activate_dark_theme()